@@ -0,0 +1,180 @@
+"""
+HTTP archive of `--record DIR`, served back by `--replay DIR`
+
+The archive is a directory with two files: `bodies.bin`, the response bodies as
+received (still compressed when the server sent a `Content-Encoding`), each
+distinct body stored once, and `index.jsonl`, one line per exchange with the
+request, the response status and headers, the body offset and the time it took.
+Both are appended as responses arrive, an interrupted recording stays readable.
+
+Replay matches method, URL, `Range` header and request body. The same request
+recorded several times is answered in recorded order, the last answer repeats.
+Nothing is sent to the network, requests missing from the archive fail.
+"""
+import asyncio, hashlib, json, pathlib, threading, time
+import httpx
+
+INDEX_NAME = "index.jsonl"
+BODIES_NAME = "bodies.bin"
+
+class ReplayMissError(httpx.TransportError):
+    """The request was not recorded"""
+
+def request_key(request: httpx.Request) -> tuple[str, str, str, str]:
+    content = request.read()
+    return (
+        request.method,
+        str(request.url),
+        request.headers.get("Range", ""),
+        hashlib.sha256(content).hexdigest() if content else "",
+    )
+
+class HttpArchive:
+    def __init__(self, path: str | pathlib.Path, mode: str, timing: bool = False):
+        """`mode` is `record` or `replay`, `timing` replays with the recorded response times"""
+        self.path = pathlib.Path(path)
+        self.mode = mode
+        self.timing = timing
+        self.started = time.perf_counter()
+        self.entries: dict[tuple[str, str, str, str], list[dict]] = dict()
+        self.cursors: dict[tuple[str, str, str, str], int] = dict()
+        self.offsets: dict[str, tuple[int, int]] = dict()
+        self._lock = threading.Lock()
+
+        if mode == "record":
+            self.path.mkdir(parents=True, exist_ok=True)
+        elif not (self.path / INDEX_NAME).exists():
+            raise FileNotFoundError(f"No archive in '{self.path}'")
+        if (self.path / INDEX_NAME).exists():
+            with open(self.path / INDEX_NAME, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    key = (entry["method"], entry["url"], entry["range"], entry["request_sha256"])
+                    self.entries.setdefault(key, list()).append(entry)
+                    self.offsets[entry["sha256"]] = (entry["offset"], entry["length"])
+
+        if mode == "record":
+            self.index_file = open(self.path / INDEX_NAME, "a", encoding="utf-8")
+            self.bodies_file = open(self.path / BODIES_NAME, "ab")
+        else:
+            self.bodies_file = open(self.path / BODIES_NAME, "rb")
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+
+    def record(self, client_name: str, request: httpx.Request, response: httpx.Response, body: bytes, elapsed: float):
+        key = request_key(request)
+        sha256 = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            if sha256 not in self.offsets:
+                self.offsets[sha256] = (self.bodies_file.tell(), len(body))
+                self.bodies_file.write(body)
+                self.bodies_file.flush()
+            offset, length = self.offsets[sha256]
+            entry = {
+                "client": client_name,
+                "method": key[0],
+                "url": key[1],
+                "range": key[2],
+                "request_sha256": key[3],
+                "status": response.status_code,
+                "headers": [[name, value] for name, value in response.headers.multi_items()],
+                "http_version": response.extensions.get("http_version", b"HTTP/1.1").decode("ascii"),
+                "sha256": sha256,
+                "offset": offset,
+                "length": length,
+                "started": round(time.perf_counter() - elapsed - self.started, 6),
+                "elapsed": round(elapsed, 6),
+            }
+            self.entries.setdefault(key, list()).append(entry)
+            self.index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.index_file.flush()
+
+    def lookup(self, request: httpx.Request) -> tuple[dict, bytes]:
+        key = request_key(request)
+        with self._lock:
+            entries = self.entries.get(key)
+            if not entries:
+                raise ReplayMissError(f"Not in archive '{self.path}': {request.method} {request.url}", request=request)
+            cursor = self.cursors.get(key, 0)
+            self.cursors[key] = cursor + 1
+            entry = entries[min(cursor, len(entries) - 1)]
+            self.bodies_file.seek(entry["offset"])
+            body = self.bodies_file.read(entry["length"])
+        return entry, body
+
+    @staticmethod
+    def build_response(status: int, headers, body: bytes, http_version: str = "HTTP/1.1") -> httpx.Response:
+        return httpx.Response(status, headers=headers, content=body, extensions={"http_version": http_version.encode("ascii")})
+
+    def wrap(self, transport: httpx.BaseTransport | httpx.AsyncBaseTransport, client_name: str):
+        if isinstance(transport, httpx.AsyncBaseTransport):
+            return AsyncArchiveTransport(self, transport, client_name)
+        return ArchiveTransport(self, transport, client_name)
+
+    def close(self):
+        if self.mode == "record":
+            self.index_file.close()
+        self.bodies_file.close()
+
+class ArchiveTransport(httpx.BaseTransport):
+    def __init__(self, archive: HttpArchive, transport: httpx.BaseTransport, client_name: str):
+        self.archive = archive
+        self.transport = transport
+        self.client_name = client_name
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.archive.mode == "replay":
+            entry, body = self.archive.lookup(request)
+            if self.archive.timing:
+                time.sleep(entry["elapsed"])
+            return HttpArchive.build_response(entry["status"], entry["headers"], body, entry["http_version"])
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        try:
+            body = b"".join(response.stream)
+        finally:
+            response.close()
+        self.archive.record(self.client_name, request, response, body, time.perf_counter() - started)
+        return HttpArchive.build_response(
+            response.status_code, response.headers.multi_items(), body,
+            response.extensions.get("http_version", b"HTTP/1.1").decode("ascii")
+        )
+
+    def close(self):
+        self.transport.close()
+
+class AsyncArchiveTransport(httpx.AsyncBaseTransport):
+    def __init__(self, archive: HttpArchive, transport: httpx.AsyncBaseTransport, client_name: str):
+        self.archive = archive
+        self.transport = transport
+        self.client_name = client_name
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.archive.mode == "replay":
+            entry, body = self.archive.lookup(request)
+            if self.archive.timing:
+                await asyncio.sleep(entry["elapsed"])
+            return HttpArchive.build_response(entry["status"], entry["headers"], body, entry["http_version"])
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        try:
+            body = b"".join([chunk async for chunk in response.stream])
+        finally:
+            await response.aclose()
+        self.archive.record(self.client_name, request, response, body, time.perf_counter() - started)
+        return HttpArchive.build_response(
+            response.status_code, response.headers.multi_items(), body,
+            response.extensions.get("http_version", b"HTTP/1.1").decode("ascii")
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+active: HttpArchive | None = None
+
+def wrap(transport: httpx.BaseTransport | httpx.AsyncBaseTransport, client_name: str):
+    """`transport` through the archive of `--record`/`--replay`, unchanged without one"""
+    return active.wrap(transport, client_name) if active is not None else transport
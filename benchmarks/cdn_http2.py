@@ -0,0 +1,186 @@
+"""
+Pages per second of the image CDN client over HTTP/1.1 and HTTP/2
+
+Starts a local TLS stand-in for the image CDN (self-signed certificate, needs
+`openssl` on PATH) that speaks both protocols through ALPN, then fetches the
+same synthetic pages through `ComiciClient.build_cdn_client` with each setting.
+
+    python benchmarks/cdn_http2.py --pages 400 --concurrency 16 --latency 20
+"""
+import asyncio, ssl, subprocess, sys, tempfile, time, pathlib, os
+import httpx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from client import ComiciClient
+
+try:
+    import h2.config, h2.connection, h2.events
+except ImportError:
+    h2 = None
+
+class CDNStandIn:
+    """Serves a fixed payload for any path, over HTTP/1.1 or HTTP/2 depending on ALPN"""
+    def __init__(self, payload: bytes, latency: float = 0.0):
+        self.payload = payload
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+
+    def ssl_context(self, workdir: pathlib.Path) -> ssl.SSLContext:
+        cert, key = workdir / "cert.pem", workdir / "key.pem"
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                "-subj", "/CN=127.0.0.1", "-keyout", str(key), "-out", str(cert),
+            ],
+            check=True, capture_output=True
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        context.set_alpn_protocols(["h2", "http/1.1"] if h2 else ["http/1.1"])
+        return context
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        ssl_object = writer.get_extra_info("ssl_object")
+        try:
+            if ssl_object and ssl_object.selected_alpn_protocol() == "h2":
+                await self.handle_h2(reader, writer)
+            else:
+                await self.handle_http1(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http1(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            if not head:
+                return
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            body = b"" if head.startswith(b"HEAD") else self.payload
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: image/jpeg\r\n"
+                + f"Content-Length: {len(self.payload)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+
+    async def handle_h2(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        pending: dict[int, memoryview] = dict()
+
+        def flush():
+            for stream_id in list(pending):
+                data = pending[stream_id]
+                while data:
+                    size = min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size, len(data))
+                    if size <= 0:
+                        break
+                    conn.send_data(stream_id, data[:size].tobytes(), end_stream=size == len(data))
+                    data = data[size:]
+                if data:
+                    pending[stream_id] = data
+                else:
+                    del pending[stream_id]
+            writer.write(conn.data_to_send())
+
+        async def respond(stream_id: int, head: bool):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            conn.send_headers(stream_id, [
+                (":status", "200"),
+                ("content-type", "image/jpeg"),
+                ("content-length", str(len(self.payload))),
+            ], end_stream=head)
+            if not head:
+                pending[stream_id] = memoryview(self.payload)
+            flush()
+            await writer.drain()
+
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    self.requests += 1
+                    method = dict(event.headers).get(b":method", b"GET")
+                    asyncio.ensure_future(respond(event.stream_id, method == b"HEAD"))
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            flush()
+            await writer.drain()
+
+async def fetch_pages(url: str, pages: int, concurrency: int, http2: bool, limits: httpx.Limits, warmup: bool) -> dict:
+    client = ComiciClient.build_cdn_client({"User-Agent": "benchmark"}, http2=http2, limits=limits, is_async=True, verify=False)
+    semaphore = asyncio.Semaphore(concurrency)
+    received = 0
+
+    async def fetch(i: int):
+        nonlocal received
+        async with semaphore:
+            response = await client.get(f"{url}/img/{i}.jpg")
+            response.raise_for_status()
+            received += len(response.content)
+            return response.http_version
+
+    start = time.perf_counter()
+    if warmup:
+        await asyncio.gather(*[client.head(f"{url}/warmup") for _ in range(1 if http2 else concurrency)])
+    versions = await asyncio.gather(*[fetch(i) for i in range(pages)])
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return {
+        "version": versions[0] if versions else "-",
+        "elapsed": elapsed,
+        "pages_per_second": pages / elapsed,
+        "mb_per_second": received / elapsed / 1024 / 1024,
+    }
+
+async def main(pages: int, concurrency: int, latency: float, payload_size: int, keepalive_expiry: float):
+    server = CDNStandIn(os.urandom(payload_size), latency / 1000)
+    with tempfile.TemporaryDirectory() as workdir:
+        context = server.ssl_context(pathlib.Path(workdir))
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0, ssl=context)
+    url = f"https://127.0.0.1:{listener.sockets[0].getsockname()[1]}"
+
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency,
+        keepalive_expiry=keepalive_expiry,
+    )
+    modes = [("HTTP/1.1", False, False), ("HTTP/1.1 + warm-up", False, True)]
+    if h2 and ComiciClient.http2_available():
+        modes += [("HTTP/2", True, False), ("HTTP/2 + warm-up", True, True)]
+    else:
+        print("h2 is not installed, HTTP/2 modes skipped (pip install httpx[http2])")
+
+    print(f"{pages} pages x {payload_size // 1024} KiB, concurrency {concurrency}, latency {latency} ms")
+    print(f"{'mode':<20} {'negotiated':<10} {'conns':>6} {'seconds':>8} {'pages/s':>9} {'MB/s':>8}")
+    for name, http2, warmup in modes:
+        connections = server.connections
+        result = await fetch_pages(url, pages, concurrency, http2, limits, warmup)
+        print(
+            f"{name:<20} {result['version']:<10} {server.connections - connections:>6} "
+            f"{result['elapsed']:>8.2f} {result['pages_per_second']:>9.1f} {result['mb_per_second']:>8.1f}"
+        )
+
+    listener.close()
+    await listener.wait_closed()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=20.0, help="Simulated CDN latency per request in ms")
+    parser.add_argument("--payload-size", type=int, default=300 * 1024, help="Bytes per page")
+    parser.add_argument("--keepalive-expiry", type=float, default=5.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.pages, args.concurrency, args.latency, args.payload_size, args.keepalive_expiry))
@@ -0,0 +1,285 @@
+"""
+Local stand-in for a Comici+ site and its image CDN
+
+Serves the old version HTML endpoints (`/series/<id>/pagingList`, `/search`,
+`/book/...`) or the new version `/api/...` JSON endpoints, and synthetic page
+JPEGs scrambled with known `scramble` permutations, so downloads can be driven
+end to end without touching a live host.
+
+    python benchmarks/comici_standin.py --port 8000 [--new-version]
+    python main.py config set --host http://127.0.0.1:8000
+"""
+import io, json, random, re, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image, ImageDraw
+
+BLOCKS_PER_SIDE = 4
+
+def scramble_image(image: Image.Image, scramble: list[int]) -> Image.Image:
+    """Inverse of `ComiciClient.descramble_image`"""
+    width = image.width - image.width % BLOCKS_PER_SIDE
+    height = image.height - image.height % BLOCKS_PER_SIDE
+    tile_w, tile_h = width // BLOCKS_PER_SIDE, height // BLOCKS_PER_SIDE
+
+    def box(row: int, col: int) -> tuple[int, int, int, int]:
+        return col * tile_w, row * tile_h, (col + 1) * tile_w, (row + 1) * tile_h
+
+    pos = [(row, col) for col in range(BLOCKS_PER_SIDE) for row in range(BLOCKS_PER_SIDE)]
+    result = image.copy()
+    for i, j in enumerate(scramble):
+        result.paste(image.crop(box(*pos[i])), box(*pos[j]))
+    return result
+
+def synthetic_page(size: tuple[int, int], seed: int) -> Image.Image:
+    """Mostly white page with panels, lines and a screentone-like noise area"""
+    rnd = random.Random(seed)
+    image = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for _ in range(4):
+        x0, y0 = rnd.randrange(size[0] // 2), rnd.randrange(size[1] // 2)
+        draw.rectangle((x0, y0, x0 + rnd.randrange(size[0] // 4, size[0] // 2), y0 + rnd.randrange(size[1] // 4, size[1] // 2)), outline=(0, 0, 0), width=4)
+    for _ in range(60):
+        draw.line(
+            (rnd.randrange(size[0]), rnd.randrange(size[1]), rnd.randrange(size[0]), rnd.randrange(size[1])),
+            fill=(rnd.randrange(64),) * 3, width=rnd.randrange(1, 4)
+        )
+    noise = Image.effect_noise((size[0] // 3, size[1] // 4), 40).convert("RGB")
+    image.paste(noise, (rnd.randrange(size[0] - noise.width), rnd.randrange(size[1] - noise.height)))
+    draw.text((20, 20), f"page {seed}", fill=(0, 0, 0))
+    return image
+
+class StandInSite:
+    """Catalogue of one series, all pages are generated up front"""
+    def __init__(
+            self,
+            new_version: bool = False,
+            episodes: int = 3,
+            pages: int = 10,
+            size: tuple[int, int] = (1360, 1920),
+            quality: int = 95,
+            latency: float = 0.0,
+            expires_in: float = 600.0,
+        ):
+        self.new_version = new_version
+        self.latency = latency
+        self.expires_in = expires_in
+        self.series_id = "bench00series"
+        self.episode_ids = [f"bench{i:08d}" for i in range(episodes)]
+        self.viewer_ids = {episode_id: f"{i:032x}" for i, episode_id in enumerate(self.episode_ids)}
+        self.page_count = pages
+        self.size = size
+
+        self.requests = 0
+        self.bytes_sent = 0
+        self.first_image_at: float | None = None
+        self._lock = threading.Lock()
+
+        self.pages: dict[tuple[str, int], tuple[list[int], bytes]] = dict()
+        rnd = random.Random(0)
+        for e, episode_id in enumerate(self.episode_ids):
+            for p in range(pages):
+                scramble = list(range(BLOCKS_PER_SIDE * BLOCKS_PER_SIDE))
+                rnd.shuffle(scramble)
+                buffer = io.BytesIO()
+                scramble_image(synthetic_page(size, e * 1000 + p), scramble).save(buffer, "JPEG", quality=quality)
+                self.pages[(self.viewer_ids[episode_id], p)] = (scramble, buffer.getvalue())
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.first_image_at = None
+
+    def episode_html(self, host: str, episode_id: str) -> str:
+        return (
+            '<span id="login_user_id"></span>'
+            f'<div id="comici-viewer" comici-viewer-id="{self.viewer_ids[episode_id]}" series-id="{self.series_id}"></div>'
+        )
+
+    def paging_list_html(self, host: str) -> str:
+        items = "".join(
+            '<div class="series-ep-list-item">'
+            f'<a data-href="{host}/episodes/{episode_id}"></a>'
+            '<div class="series-ep-list-item-main">'
+            f'<span class="series-ep-list-item-h-text">Episode {i + 1}</span>'
+            f'<p class="series-ep-list-date">2024/01/{i % 28 + 1:02d}</p></div>'
+            '<div class="series-ep-list-symbols"><div class="mode-list"><span>無料</span></div></div>'
+            '</div>'
+            for i, episode_id in enumerate(self.episode_ids)
+        )
+        return f'<span id="login_user_id"></span><div class="series-ep-list">{items}</div>'
+
+    def search_html(self, host: str) -> str:
+        return (
+            '<span id="login_user_id"></span><div class="series-list"><div class="manga-store-item">'
+            f'<a href="{host}/series/{self.series_id}"></a>'
+            f'<a href="{host}/authors/bench"><span class="manga-author-name">Bench Author</span></a>'
+            '<h2 class="manga-title">Bench Series</h2></div></div>'
+        )
+
+    def series_list_html(self, host: str) -> str:
+        return (
+            '<div class="series-list"><div class="series-box-vertical">'
+            f'<a href="{host}/series/{self.series_id}"></a>'
+            '<div class="article-text"><h2 class="title-text">Bench Series</h2></div>'
+            f'<div class="author">作者: <a href="{host}/authors/bench">Bench Author</a></div>'
+            '</div></div>'
+        )
+
+    def summary(self) -> dict:
+        return {
+            "id": self.series_id,
+            "name": "Bench Series",
+            "author": [{"role": "", "name": "Bench Author", "authorPageLink": "/authors/bench"}],
+            "numEpisodes": len(self.episode_ids),
+            "images": [],
+            "description": "",
+            "publishDate": 1700000000,
+        }
+
+    def contents_info(self, host: str, comici_viewer_id: str, page_from: int, page_to: int) -> dict:
+        expires_on = int((time.time() + self.expires_in) * 1000)
+        return {
+            "code": 1000,
+            "totalPages": self.page_count,
+            "result": [
+                {
+                    "imageUrl": f"{host}/images/{comici_viewer_id}/{p}.jpg?expires={expires_on}",
+                    "scramble": json.dumps(self.pages[(comici_viewer_id, p)][0]),
+                    "sort": p,
+                    "width": self.size[0],
+                    "height": self.size[1],
+                    "expiresOn": expires_on,
+                }
+                for p in range(max(page_from, 0), min(page_to, self.page_count - 1) + 1)
+            ],
+        }
+
+def make_handler(site: StandInSite) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, body: bytes | str, content_type: str = "text/html; charset=utf-8", status: int = 200):
+            if isinstance(body, str):
+                body = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+            with site._lock:
+                site.bytes_sent += len(body)
+
+        def reply_json(self, obj):
+            self.reply(json.dumps(obj), "application/json")
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            with site._lock:
+                site.requests += 1
+            if site.latency:
+                time.sleep(site.latency)
+
+            url = urlsplit(self.path)
+            path = url.path
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            host = f"http://{self.headers['Host']}"
+
+            if match := re.fullmatch(r"/images/(\w+)/(\d+)\.jpg", path):
+                if int(query.get("expires", 0)) < time.time() * 1000:
+                    return self.reply(b"expired", "text/plain", 403)
+                with site._lock:
+                    if site.first_image_at is None:
+                        site.first_image_at = time.perf_counter()
+                return self.reply(site.pages[(match.group(1), int(match.group(2)))][1], "image/jpeg")
+            if path == "/":
+                return self.reply(
+                    ('' if site.new_version else '<span id="contentLink"></span>')
+                    + '<span id="login_user_id"></span>'
+                )
+            if match := re.fullmatch(r"/episodes/(\w+)/?", path):
+                if match.group(1) not in site.viewer_ids:
+                    return self.reply("", status=404)
+                return self.reply(site.episode_html(host, match.group(1)))
+            if path in ("/book/contentsInfo", "/api/book/contentsInfo"):
+                return self.reply_json(site.contents_info(
+                    host, query["comici-viewer-id"], int(query["page-from"]), int(query["page-to"])
+                ))
+
+            if not site.new_version:
+                if path == "/book/Info":
+                    return self.reply_json({"code": 1000, "result": {
+                        "id": query["comici-viewer-id"], "title": "Bench Series", "thumb_image_url": "",
+                        "description": "", "publish_date": "2024-01-01T00:00:00+09:00", "end_date": "", "authors": None,
+                    }})
+                if path == "/book/episodeInfo":
+                    return self.reply_json({"code": 1000, "result": [
+                        {
+                            "id": site.viewer_ids[episode_id], "name": f"Episode {i + 1}", "description": "",
+                            "thumb_image_url": "", "page_count": str(site.page_count), "episode_number": str(i + 1),
+                            "publish_date": f"2024-01-{i % 28 + 1:02d}T00:00:00+09:00", "end_date": "",
+                        }
+                        for i, episode_id in enumerate(site.episode_ids)
+                    ]})
+                if re.fullmatch(rf"/series/{site.series_id}/pagingList", path):
+                    return self.reply(site.paging_list_html(host))
+                if path == "/search":
+                    return self.reply(site.search_html(host))
+                if path == "/series/list":
+                    return self.reply(site.series_list_html(host))
+            else:
+                if path == "/api/popups":
+                    return self.reply_json({"topPopup": {}})
+                if path in ("/api/episodes", "/api/series/access"):
+                    low = int(query["episodeFrom"])
+                    high = min(int(query["episodeTo"]), len(site.episode_ids))
+                    if path == "/api/series/access":
+                        return self.reply_json({"seriesAccess": {"episodeAccesses": [
+                            {"hasAccess": True, "accessType": "FREE"} for _ in range(low, high + 1)
+                        ]}})
+                    return self.reply_json({"series": {"summary": site.summary(), "episodes": [
+                        {"id": episode_id, "title": f"Episode {i + 1}", "datePublished": 1700000000 + i * 86400, "thumbnailImages": []}
+                        for i, episode_id in enumerate(site.episode_ids) if low <= i + 1 <= high
+                    ]}})
+                if path == "/api/search":
+                    return self.reply_json({"searchResult": {
+                        key: {key: [{"id": site.series_id, "name": "Bench Series", "authors": site.summary()["author"]}], "total": 1}
+                        for key in ("series", "seriesByAuthor", "episode")
+                    }})
+
+            self.reply("", status=404)
+
+    return Handler
+
+def serve(site: StandInSite, port: int = 0) -> ThreadingHTTPServer:
+    """Start serving in a daemon thread, `server.server_address` has the bound port"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--new-version", action="store_true")
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    site = StandInSite(args.new_version, args.episodes, args.pages, latency=args.latency)
+    server = serve(site, args.port)
+    print(f"Serving {'new' if args.new_version else 'old'} version Comici at http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
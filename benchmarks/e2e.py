@@ -0,0 +1,134 @@
+"""
+End-to-end download benchmark against a local Comici stand-in
+
+Runs `main.py download-episode` / `download-series` in a subprocess for every
+output mode and reports pages/s, MB/s (CDN bytes), CPU time, peak RSS and the
+time to the first page written. Linux/macOS only, needs `os.wait4`.
+
+    python benchmarks/e2e.py --episodes 3 --pages 10 --threads 4
+    python benchmarks/e2e.py --new-version --command download-series --json bench.json
+"""
+import json, os, pathlib, subprocess, sys, tempfile, threading, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+from comici_standin import StandInSite, serve
+
+MAIN_PATH = pathlib.Path(__file__).resolve().parent.parent / "main.py"
+
+OUTPUT_MODES = {
+    "png": [],
+    "webp": ["--ls-webp"],
+    "cbz-png": ["--cbz"],
+    "cbz-webp": ["--cbz", "--ls-webp"],
+}
+
+def watch_first_page(root: pathlib.Path, started: float, stop: threading.Event) -> dict:
+    """Poll the save directory for the first non-empty page or CBZ"""
+    result = {"ttfp": None}
+    def poll():
+        while not stop.is_set():
+            for path in root.rglob("*"):
+                if path.suffix in (".png", ".webp", ".cbz") and path.is_file() and path.stat().st_size > 0:
+                    result["ttfp"] = time.perf_counter() - started
+                    return
+            time.sleep(0.005)
+    thread = threading.Thread(target=poll, daemon=True)
+    thread.start()
+    result["thread"] = thread
+    return result
+
+def run_once(site: StandInSite, host: str, command: str, mode_args: list[str], extra_args: list[str]) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = pathlib.Path(workdir)
+        (workdir / "config.json").write_text(json.dumps({"host": host}), encoding="utf-8")
+        save_dir = workdir / "out"
+        save_dir.mkdir()
+
+        target = site.episode_ids[0] if command == "download-episode" else site.series_id
+        args = [
+            sys.executable, str(MAIN_PATH), command, target,
+            "--save-dir", str(save_dir), "--wait-interval", "0", *mode_args, *extra_args
+        ]
+
+        site.reset_counters()
+        stop = threading.Event()
+        started = time.perf_counter()
+        watcher = watch_first_page(save_dir, started, stop)
+        process = subprocess.Popen(args, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        watcher["thread"].join()
+        stderr = process.stderr.read().decode(errors="replace")
+        process.stderr.close()
+
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise RuntimeError(f"{' '.join(args[2:])} failed:\n{stderr}")
+
+        pages = len(site.episode_ids) * site.page_count if command == "download-series" else site.page_count
+        output_bytes = sum(p.stat().st_size for p in save_dir.rglob("*") if p.is_file())
+        peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+        return {
+            "pages": pages,
+            "seconds": elapsed,
+            "pages_per_second": pages / elapsed,
+            "mb_per_second": site.bytes_sent / elapsed / 1024 / 1024,
+            "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+            "peak_rss_mb": peak_rss / 1024 / 1024,
+            "ttfp": watcher["ttfp"],
+            "requests": site.requests,
+            "output_mb": output_bytes / 1024 / 1024,
+        }
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--command", choices=["download-episode", "download-series"], default="download-episode")
+    parser.add_argument("--new-version", action="store_true", help="Serve the new version /api/... endpoints")
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1360)
+    parser.add_argument("--height", type=int, default=1920)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(OUTPUT_MODES), help="Comma separated: " + ", ".join(OUTPUT_MODES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", default="", help="Also write results to this JSON file")
+    parser.add_argument("extra", nargs="*", help="Extra arguments passed to main.py after `--`")
+    args = parser.parse_args()
+
+    print("Generating synthetic pages...", file=sys.stderr)
+    site = StandInSite(
+        args.new_version, args.episodes, args.pages,
+        size=(args.width, args.height), latency=args.latency
+    )
+    server = serve(site)
+    host = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(
+        f"{args.command} on {'new' if args.new_version else 'old'} version stand-in, "
+        f"{args.pages} pages/episode, {args.width}x{args.height}, threads {args.threads}"
+    )
+    print(f"{'mode':<10} {'pages/s':>8} {'MB/s':>7} {'cpu s':>7} {'rss MB':>7} {'ttfp s':>7} {'wall s':>7} {'out MB':>7}")
+
+    results = list()
+    for mode in args.modes.split(","):
+        for _ in range(args.repeat):
+            result = run_once(site, host, args.command, OUTPUT_MODES[mode] + ["--threads", str(args.threads)], args.extra)
+            result["mode"] = mode
+            results.append(result)
+            ttfp = f"{result['ttfp']:.3f}" if result["ttfp"] is not None else "-"
+            print(
+                f"{mode:<10} {result['pages_per_second']:>8.2f} {result['mb_per_second']:>7.2f} "
+                f"{result['cpu_seconds']:>7.2f} {result['peak_rss_mb']:>7.1f} {ttfp:>7} "
+                f"{result['seconds']:>7.2f} {result['output_mb']:>7.1f}"
+            )
+
+    server.shutdown()
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
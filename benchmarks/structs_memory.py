@@ -0,0 +1,124 @@
+"""
+Memory and build time of a catalogue index of EpisodeInfo / ContentsInfo
+
+Builds `{_id: EpisodeInfo}` for N synthetic `book/episodeInfo` rows with the
+slotted structs of `structs.py`, which share the parsed dates and scrambles of
+repeated API values, and with the previous `__dict__` dataclasses that parsed
+every value again in `__post_init__`. Before measuring, checks that the structs
+still round-trip through `asdict()` and `replace()`.
+
+    python benchmarks/structs_memory.py --count 1000000
+"""
+import datetime, gc, json, pathlib, sys, time, tracemalloc
+from dataclasses import asdict, dataclass, fields, replace
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import structs
+
+@dataclass
+class EagerEpisodeInfo:
+    _id: str
+    name: str
+    description: str
+    thumb_image_url: str
+    page_count: str
+    episode_number: str
+    publish_date: datetime.datetime
+    end_date: datetime.datetime | None
+
+    def __post_init__(self):
+        self.publish_date = datetime.datetime.fromisoformat(self.publish_date) if self.publish_date else None
+        self.end_date = datetime.datetime.fromisoformat(self.end_date) if self.end_date else None
+
+@dataclass
+class EagerContentsInfo:
+    imageUrl: str
+    scramble: list[int]
+    sort: int
+    width: int
+    height: int
+    expiresOn: datetime.datetime
+
+    def __post_init__(self):
+        self.scramble = json.loads(self.scramble)
+        self.expiresOn = datetime.datetime.fromtimestamp(self.expiresOn / 1000)
+
+def episode_rows(count: int):
+    for i in range(count):
+        yield {
+            "_id": f"{i:032x}",
+            "name": f"第{i % 500 + 1}話",
+            "description": "",
+            "thumb_image_url": f"https://cdn.example/thumb/{i:032x}.jpg",
+            "page_count": str(20 + i % 30),
+            "episode_number": str(i % 500 + 1),
+            "publish_date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T00:00:00+09:00",
+            "end_date": "" if i % 3 else "2099-12-31T23:59:59+09:00",
+        }
+
+SCRAMBLE = json.dumps([15, 3, 8, 0, 12, 5, 10, 1, 14, 7, 2, 11, 4, 9, 6, 13])
+
+def contents_rows(count: int):
+    for i in range(count):
+        yield {
+            "imageUrl": f"https://cdn.example/pages/{i:032x}.jpg?Expires=1700000000&Signature=abc",
+            "scramble": SCRAMBLE,
+            "sort": i % 40,
+            "width": 1360,
+            "height": 1920,
+            "expiresOn": 1700000000000 + i,
+        }
+
+def check_round_trip():
+    """The public fields of the parsed structs stay plain dataclass fields"""
+    episode = structs.EpisodeInfo(**next(episode_rows(1)))
+    assert [f.name for f in fields(episode)][-2:] == ["publish_date", "end_date"]
+    assert isinstance(episode.publish_date, datetime.datetime)
+    assert structs.EpisodeInfo(**asdict(episode)) == episode
+    assert replace(episode, name="renamed").name == "renamed"
+    assert replace(episode, name="renamed").publish_date == episode.publish_date
+
+    contents = structs.ContentsInfo(**next(contents_rows(1)))
+    assert contents.scramble == json.loads(SCRAMBLE) and isinstance(contents.expiresOn, datetime.datetime)
+    assert structs.ContentsInfo(**asdict(contents)) == contents
+    assert replace(contents, sort=3) == structs.ContentsInfo(**{**next(contents_rows(1)), "sort": 3})
+    assert "scramble=" in repr(contents) and "_scramble" not in repr(contents)
+
+def measure(name: str, build) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = build()
+    seconds = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"name": name, "items": len(index), "seconds": seconds, "retained_mb": current / 1024 / 1024, "peak_mb": peak / 1024 / 1024}
+    del index
+    gc.collect()
+    return result
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=1_000_000, help="Episodes in the index")
+    parser.add_argument("--contents", type=int, default=200_000, help="ContentsInfo entries")
+    args = parser.parse_args()
+    check_round_trip()
+
+    cases = [
+        ("EpisodeInfo (eager, __dict__)", lambda: {r["_id"]: EagerEpisodeInfo(**r) for r in episode_rows(args.count)}),
+        ("EpisodeInfo (cached, slots)", lambda: {r["_id"]: structs.EpisodeInfo(**r) for r in episode_rows(args.count)}),
+        ("ContentsInfo (eager, __dict__)", lambda: [EagerContentsInfo(**r) for r in contents_rows(args.contents)]),
+        ("ContentsInfo (cached, slots)", lambda: [structs.ContentsInfo(**r) for r in contents_rows(args.contents)]),
+    ]
+
+    print(f"{'case':<32} {'items':>9} {'build s':>8} {'items/s':>10} {'retained MB':>12} {'peak MB':>8}")
+    for name, build in cases:
+        r = measure(name, build)
+        print(
+            f"{r['name']:<32} {r['items']:>9} {r['seconds']:>8.2f} {r['items'] / r['seconds']:>10.0f} "
+            f"{r['retained_mb']:>12.1f} {r['peak_mb']:>8.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
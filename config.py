@@ -1,6 +1,6 @@
 import typer, json, pathlib
 from rich.console import Console
-from urllib.parse import urlsplit
+from utils import normalizeHost
 
 app = typer.Typer(rich_markup_mode="markdown")
 console = Console()
@@ -11,6 +11,13 @@ def set(
     proxy: str = typer.Option("", help="Proxy URL"),
     user_agent: str = "",
     host: str = typer.Option("", help="Default host, should be any comic site powered by Comici(コミチ)"),
+    store: str = typer.Option("", help="Directory of the content-addressed page store shared by all downloads"),
+    cache_dir: str = typer.Option("", help="Directory to cache signed page URLs until they expire, default: .cache"),
+    http2: bool | None = typer.Option(None, "--http2/--no-http2", help="Use HTTP/2 for the image CDN, needs `pip install httpx[http2]`"),
+    max_connections: int = typer.Option(0, min = 0, help="Max CDN connections in the pool, default: 100"),
+    max_keepalive_connections: int = typer.Option(0, min = 0, help="Max idle CDN connections kept alive, default: 20"),
+    keepalive_expiry: float = typer.Option(0, min = 0, help="Seconds an idle CDN connection is kept alive, default: 5"),
+    warmup: bool | None = typer.Option(None, "--warmup/--no-warmup", help="Open CDN connections before the first page batch"),
 ):
     """
     Write config to `config.json`
@@ -18,13 +25,20 @@ def set(
     config = dict()
     if pathlib.Path("config.json").exists():
         with open("config.json", "r", encoding="utf-8") as f:
-            if pathlib.Path(cookies).stat().st_size > 0:
+            if pathlib.Path("config.json").stat().st_size > 0:
                 config.update(json.load(f))
                 
     if cookies: config["cookies"] = cookies
     if proxy: config["proxy"] = proxy
     if user_agent: config["user_agent"] = user_agent
-    if host: config["host"] = "https://" + (urlsplit(host).hostname if urlsplit(host).hostname else host)
+    if store: config["store"] = store
+    if cache_dir: config["cache_dir"] = cache_dir
+    if http2 is not None: config["http2"] = http2
+    if max_connections: config["max_connections"] = max_connections
+    if max_keepalive_connections: config["max_keepalive_connections"] = max_keepalive_connections
+    if keepalive_expiry: config["keepalive_expiry"] = keepalive_expiry
+    if warmup is not None: config["warmup"] = warmup
+    if host: config["host"] = normalizeHost(host)
     
     with open("config.json", "w", encoding="utf-8") as f:
         json.dump(config, f, indent=2)
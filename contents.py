@@ -0,0 +1,138 @@
+import json, pathlib, datetime, threading, asyncio
+from urllib.parse import urlsplit
+from structs import ContentsInfo
+
+class ContentsInfoManager:
+    """
+    Keeps signed page URLs of one episode until shortly before `expiresOn`
+
+    URLs are cached on disk so later runs can reuse them, and only the range
+    of pages that is about to expire is requested again from `book_contentsInfo`.
+    """
+    REFRESH_MARGIN = datetime.timedelta(seconds=60)
+
+    def __init__(
+            self,
+            client,
+            comici_viewer_id: str,
+            user_id: int | str | None = None,
+            cache_dir: str | pathlib.Path | None = None,
+        ):
+        self.client = client
+        self.comici_viewer_id = comici_viewer_id
+        self.user_id = user_id if user_id else "0"
+        self.total_pages = 0
+        self.pages: dict[int, ContentsInfo] = dict()
+
+        self._lock = threading.Lock()
+        self._async_lock: asyncio.Lock | None = None
+
+        self.cache_path = None
+        if cache_dir:
+            self.cache_path = pathlib.Path(cache_dir) / "contents" / "{}_{}_{}.json".format(
+                urlsplit(client.HOST).netloc.replace(":", "_"), comici_viewer_id, self.user_id
+            )
+            self._load_cache()
+
+    @staticmethod
+    def to_dict(contents: ContentsInfo) -> dict:
+        return {
+            "imageUrl": contents.imageUrl,
+            "scramble": json.dumps(contents.scramble),
+            "sort": contents.sort,
+            "width": contents.width,
+            "height": contents.height,
+            "expiresOn": int(contents.expiresOn.timestamp() * 1000),
+        }
+
+    def _load_cache(self):
+        if not self.cache_path.exists():
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.total_pages = cache.get("totalPages", 0)
+        for r in cache.get("result", []):
+            contents = ContentsInfo(**r)
+            if not self.expiring(contents):
+                self.pages[contents.sort] = contents
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "totalPages": self.total_pages,
+                "result": [self.to_dict(c) for c in sorted(self.pages.values(), key=lambda c: c.sort)]
+            }, f)
+        tmp_path.replace(self.cache_path)
+
+    def expiring(self, contents: ContentsInfo, margin: datetime.timedelta | None = None) -> bool:
+        return contents.expiresOn - (margin if margin is not None else self.REFRESH_MARGIN) <= datetime.datetime.now()
+
+    def refresh(self, page_from: int, page_to: int) -> list[ContentsInfo]:
+        """Request signed URLs again, only for `page_from`..`page_to`"""
+        contents_info, total_pages = self.client.book_contentsInfo(
+            self.comici_viewer_id,
+            page_from,
+            page_to,
+            self.user_id
+        )
+        with self._lock:
+            if total_pages:
+                self.total_pages = total_pages
+            for contents in contents_info:
+                self.pages[contents.sort] = contents
+            self._save_cache()
+        return contents_info
+
+    def get(self, page_from: int, page_to: int) -> list[ContentsInfo]:
+        """Cached pages which are still valid, missing or expiring ranges are refreshed"""
+        missing: list[tuple[int, int]] = list()
+        for sort in range(page_from, page_to + 1):
+            contents = self.pages.get(sort)
+            if contents and not self.expiring(contents):
+                continue
+            if missing and missing[-1][1] == sort - 1:
+                missing[-1] = (missing[-1][0], sort)
+            else:
+                missing.append((sort, sort))
+
+        for low, high in missing:
+            self.refresh(low, high)
+
+        return [self.pages[sort] for sort in range(page_from, page_to + 1) if sort in self.pages]
+
+    def page_count(self) -> int:
+        if not self.total_pages:
+            self.refresh(0, 0)
+        return self.total_pages
+
+    @staticmethod
+    def schedule(contents_info: list[ContentsInfo]) -> list[ContentsInfo]:
+        """Pages whose URLs expire first are fetched first"""
+        return sorted(contents_info, key=lambda c: (c.expiresOn, c.sort))
+
+    async def fresh(self, contents: ContentsInfo, page_to: int) -> ContentsInfo:
+        """Return a usable entry for the page, refreshing every remaining page if it is about to expire"""
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            current = self.pages.get(contents.sort, contents)
+            if self.expiring(current):
+                await asyncio.to_thread(self.refresh, contents.sort, max(page_to, contents.sort))
+            return self.pages.get(contents.sort, current)
+
+    async def renew(self, contents: ContentsInfo, page_to: int) -> ContentsInfo:
+        """Force a refresh after the CDN rejected a URL that looked valid"""
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            current = self.pages.get(contents.sort, contents)
+            if current.imageUrl == contents.imageUrl:
+                await asyncio.to_thread(self.refresh, contents.sort, max(page_to, contents.sort))
+            return self.pages.get(contents.sort, current)
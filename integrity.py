@@ -0,0 +1,53 @@
+"""
+Checks that a fetched page is the complete image, and the per-episode page manifest
+
+A truncated CDN response still decodes: libjpeg pads the missing scanlines with
+grey, so the page would be saved and skipped as existing on every later run.
+Downloads therefore check the byte count and the JPEG end-of-image marker before
+decoding, and record the sha256 of every page in a manifest next to the pages,
+which `library verify --repair` uses to find and re-fetch only the broken ones.
+"""
+import json, hashlib, os, pathlib
+
+MANIFEST_NAME = ".pages.json"
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+class PageIntegrityError(ValueError):
+    """The page bytes or the decoded page are incomplete"""
+
+def check_bytes(data: bytes, content_length: str | None = None, content_encoding: str | None = None):
+    if not data:
+        raise PageIntegrityError("Empty page")
+    if content_length and not content_encoding and int(content_length) != len(data):
+        raise PageIntegrityError(f"Got {len(data)} of {content_length} bytes")
+    # some encoders pad after EOI, anything but padding means the tail is missing
+    if data.startswith(JPEG_SOI) and not data.rstrip(b"\x00").endswith(JPEG_EOI):
+        raise PageIntegrityError("JPEG without end-of-image marker, truncated")
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def manifest_path(path: pathlib.Path) -> pathlib.Path:
+    """`<dir>/.pages.json` for page directories, `.<name>.cbz.pages.json` beside CBZ files"""
+    if path.suffix == ".cbz":
+        return path.with_name(f".{path.name}{MANIFEST_NAME}")
+    return path / MANIFEST_NAME
+
+def load_manifest(path: pathlib.Path) -> dict:
+    try:
+        with open(manifest_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"pages": dict()}
+
+def save_manifest(path: pathlib.Path, manifest: dict):
+    target = manifest_path(path)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, target)
+
+def page_entry(sort: int, sha256: str, size: int, raw_digest: str | None = None) -> dict:
+    return {"sort": sort, "size": size, "sha256": sha256, "raw_sha256": raw_digest}
@@ -0,0 +1,228 @@
+import sqlite3, json, pathlib, threading, time, httpx
+from dataclasses import asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from structs import Job
+
+JOB_COLUMNS = "id, host, series_id, episode_id, page_from, page_to, attempts"
+
+class JobQueue:
+    """
+    Episode jobs shared by workers through one SQLite file
+
+    A worker leases a job for `lease_seconds` and has to renew it with
+    `heartbeat()`, jobs of workers that stopped renewing are handed out again.
+    Failed and expired jobs are requeued until they were leased `max_attempts` times.
+    Every write runs in an immediate transaction, so the file can live on a
+    shared filesystem (no WAL) and be used by workers on several machines.
+    """
+    def __init__(self, path: str | pathlib.Path, max_attempts: int = 3):
+        self.path = pathlib.Path(path)
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._transaction():
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, host TEXT NOT NULL, series_id TEXT NOT NULL, "
+                "episode_id TEXT NOT NULL, page_from INTEGER NOT NULL, page_to INTEGER NOT NULL, "
+                "state TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL, "
+                "UNIQUE (host, episode_id, page_from, page_to))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rates (host TEXT PRIMARY KEY, next_slot REAL NOT NULL)"
+            )
+
+    def _transaction(self):
+        queue = self
+        class Transaction:
+            def __enter__(self):
+                queue._lock.acquire()
+                try:
+                    queue._db.execute("BEGIN IMMEDIATE")
+                except:
+                    queue._lock.release()
+                    raise
+                return queue._db
+
+            def __exit__(self, exc_type, *exc):
+                queue._db.execute("ROLLBACK" if exc_type else "COMMIT")
+                queue._lock.release()
+                return False
+        return Transaction()
+
+    def add(self, host: str, series_id: str, episode_id: str, page_from: int = 0, page_to: int = -1) -> bool:
+        """Returns False when the same job is already queued"""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO jobs (host, series_id, episode_id, page_from, page_to, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (host, series_id, episode_id, page_from, page_to, time.time())
+            )
+        return cursor.rowcount > 0
+
+    def lease(self, worker: str, lease_seconds: float = 60.0) -> Job | None:
+        now = time.time()
+        with self._transaction() as db:
+            # a job that kept killing its worker never reaches `fail()`
+            db.execute(
+                "UPDATE jobs SET state = 'failed', lease_expires = NULL, error = 'lease expired', updated = ? "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = db.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if not row:
+                return None
+            db.execute(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated = ? "
+                "WHERE id = ?",
+                (worker, now + lease_seconds, now, row[0])
+            )
+        job = Job(*row)
+        job.attempts += 1
+        return job
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = 60.0) -> bool:
+        """Extends the lease, False when the job was handed to another worker"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (now + lease_seconds, now, job_id, worker)
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: int, worker: str):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = 'done', lease_expires = NULL, error = NULL, updated = ? WHERE id = ? AND worker = ?",
+                (time.time(), job_id, worker)
+            )
+
+    def fail(self, job_id: int, worker: str, error: str):
+        """Requeue the job, or mark it failed after `max_attempts`"""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_expires = NULL, error = ?, updated = ? WHERE id = ? AND worker = ?",
+                (self.max_attempts, error, time.time(), job_id, worker)
+            )
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def acquire_rate(self, host: str, rate: float) -> float:
+        """
+        Reserve the next request slot of `host` at `rate` requests per second,
+        shared by every worker of the queue. Returns the seconds to wait.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute("SELECT next_slot FROM rates WHERE host = ?", (host,)).fetchone()
+            slot = max(now, row[0]) if row else now
+            db.execute("INSERT OR REPLACE INTO rates VALUES (?, ?)", (host, slot + 1 / rate))
+        return slot - now
+
+    def close(self):
+        self._db.close()
+
+class RateBudget:
+    """In-process counterpart of `JobQueue.acquire_rate()`, `per_host=False` shares one budget between all hosts"""
+    def __init__(self, per_host: bool = True):
+        self.per_host = per_host
+        self.next_slots: dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    def acquire_rate(self, host: str, rate: float) -> float:
+        key = host if self.per_host else ""
+        now = time.time()
+        with self._lock:
+            slot = max(now, self.next_slots.get(key, now))
+            self.next_slots[key] = slot + 1 / rate
+        return slot - now
+
+class RemoteJobQueue:
+    """Same interface as `JobQueue`, talking to `serve_coordinator()` over HTTP"""
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip("/")
+        self._client = httpx.Client(timeout=timeout)
+
+    def _call(self, method: str, **params):
+        response = self._client.post(f"{self.url}/{method}", json=params)
+        response.raise_for_status()
+        return response.json()["result"]
+
+    def add(self, host: str, series_id: str, episode_id: str, page_from: int = 0, page_to: int = -1) -> bool:
+        return self._call("add", host=host, series_id=series_id, episode_id=episode_id, page_from=page_from, page_to=page_to)
+
+    def lease(self, worker: str, lease_seconds: float = 60.0) -> Job | None:
+        result = self._call("lease", worker=worker, lease_seconds=lease_seconds)
+        return Job(**result) if result else None
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = 60.0) -> bool:
+        return self._call("heartbeat", job_id=job_id, worker=worker, lease_seconds=lease_seconds)
+
+    def complete(self, job_id: int, worker: str):
+        self._call("complete", job_id=job_id, worker=worker)
+
+    def fail(self, job_id: int, worker: str, error: str):
+        self._call("fail", job_id=job_id, worker=worker, error=error)
+
+    def counts(self) -> dict[str, int]:
+        return self._call("counts")
+
+    def acquire_rate(self, host: str, rate: float) -> float:
+        return self._call("acquire_rate", host=host, rate=rate)
+
+    def close(self):
+        self._client.close()
+
+def open_queue(location: str) -> JobQueue | RemoteJobQueue:
+    """`http://...` for a coordinator, anything else is a SQLite file"""
+    if location.startswith(("http://", "https://")):
+        return RemoteJobQueue(location)
+    return JobQueue(location)
+
+def serve_coordinator(queue: JobQueue, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """JSON API over a local `JobQueue`: `POST /<method>` with the method arguments as body"""
+    methods = {"add", "lease", "heartbeat", "complete", "fail", "counts", "acquire_rate"}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/counts":
+                self.reply(200, {"result": queue.counts()})
+            else:
+                self.reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            method = self.path.strip("/")
+            if method not in methods:
+                self.reply(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            params = json.loads(self.rfile.read(length) or b"{}")
+            try:
+                result = getattr(queue, method)(**params)
+            except (TypeError, ValueError, sqlite3.Error) as e:
+                self.reply(400, {"error": str(e)})
+                return
+            self.reply(200, {"result": asdict(result) if isinstance(result, Job) else result})
+
+    return ThreadingHTTPServer((host, port), Handler)
@@ -0,0 +1,300 @@
+import typer, os, io, pathlib, shutil, zipfile, concurrent.futures
+from PIL import Image
+from rich.console import Console
+from rich.progress import track
+from utils import encodeImage
+from store import PageStore
+from client import ComiciClient
+from contents import ContentsInfoManager
+from integrity import digest, page_entry, manifest_path, load_manifest, save_manifest
+
+app = typer.Typer(rich_markup_mode="markdown")
+console = Console()
+
+PAGE_SUFFIXES = (".png", ".webp")
+ENCODING_MARKER = ".encoding"
+CBZ_COMMENT_PREFIX = b"comici-encoding:"
+
+def find_episodes(save_dir: pathlib.Path) -> tuple[list[pathlib.Path], list[pathlib.Path]]:
+    """Episode directories with pages and CBZ files below `save_dir`, as written by `download-episode`"""
+    directories, cbz_files = list(), list()
+    for root, _, files in os.walk(save_dir):
+        root = pathlib.Path(root)
+        if any(f.endswith(PAGE_SUFFIXES) and not f.startswith(".") for f in files):
+            directories.append(root)
+        cbz_files.extend(root / f for f in files if f.endswith(".cbz"))
+    return sorted(directories), sorted(cbz_files)
+
+def page_files(directory: pathlib.Path) -> list[pathlib.Path]:
+    return sorted(p for p in directory.iterdir() if p.suffix in PAGE_SUFFIXES and not p.name.startswith("."))
+
+def atomic_write(path: pathlib.Path, data: bytes):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+def repack_episode(directory: pathlib.Path, remove_source: bool) -> str:
+    """Pack a page directory into `<directory>.cbz`, skipped when the CBZ is newer than every page"""
+    pages = page_files(directory)
+    cbz_path = directory.parent / f"{directory.name}.cbz"
+    if cbz_path.exists() and cbz_path.stat().st_mtime >= max(p.stat().st_mtime for p in pages):
+        return "skipped"
+
+    tmp_path = cbz_path.with_name(f".{cbz_path.name}.{os.getpid()}.tmp")
+    with zipfile.ZipFile(tmp_path, "w") as cbz_file:
+        for page in pages:
+            cbz_file.write(page, page.name)
+        marker = directory / ENCODING_MARKER
+        if marker.exists():
+            cbz_file.comment = CBZ_COMMENT_PREFIX + marker.read_bytes().strip()
+    os.replace(tmp_path, cbz_path)
+    if manifest_path(directory).exists():
+        shutil.copyfile(manifest_path(directory), manifest_path(cbz_path))
+
+    if remove_source:
+        for page in pages:
+            page.unlink()
+        (directory / ENCODING_MARKER).unlink(missing_ok=True)
+        manifest_path(directory).unlink(missing_ok=True)
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+    return "repacked"
+
+def recorded_max_size(path: pathlib.Path, manifest: dict | None) -> tuple[int, int] | None:
+    """Max size the pages were scaled to, from the manifest, the encoding marker or the CBZ comment"""
+    encoding = manifest.get("encoding", "") if manifest else ""
+    if not encoding and path.suffix == ".cbz":
+        with zipfile.ZipFile(path) as cbz_file:
+            if cbz_file.comment.startswith(CBZ_COMMENT_PREFIX):
+                encoding = cbz_file.comment[len(CBZ_COMMENT_PREFIX):].decode()
+    elif not encoding and (path / ENCODING_MARKER).exists():
+        encoding = (path / ENCODING_MARKER).read_text(encoding="utf-8").strip()
+    try:
+        return PageStore.parse_encoding(encoding)[2]
+    except (IndexError, ValueError):
+        return None
+
+def transcode_episode(path: pathlib.Path, ls_webp: bool, compression: int, force: bool) -> str:
+    """Re-encode the pages of a directory or CBZ, the encoding is recorded so finished episodes are skipped"""
+    manifest = load_manifest(path) if manifest_path(path).exists() else None
+    # transcoding keeps the size, so does the encoding
+    encoding = PageStore.encoding_key(ls_webp, compression, recorded_max_size(path, manifest))
+    suffix = ".webp" if ls_webp else ".png"
+
+    def rename(name: str, new_name: str, data: bytes):
+        if manifest and name in manifest["pages"]:
+            entry = manifest["pages"].pop(name)
+            manifest["pages"][new_name] = page_entry(entry["sort"], digest(data), len(data), entry.get("raw_sha256"))
+
+    if path.suffix == ".cbz":
+        with zipfile.ZipFile(path) as cbz_file:
+            if not force and cbz_file.comment == CBZ_COMMENT_PREFIX + encoding.encode():
+                return "skipped"
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            with zipfile.ZipFile(tmp_path, "w") as output:
+                for name in cbz_file.namelist():
+                    if not name.endswith(PAGE_SUFFIXES):
+                        output.writestr(name, cbz_file.read(name))
+                        continue
+                    with Image.open(io.BytesIO(cbz_file.read(name))) as image:
+                        data = encodeImage(image, ls_webp, compression)
+                    new_name = str(pathlib.PurePosixPath(name).with_suffix(suffix))
+                    output.writestr(new_name, data)
+                    rename(name, new_name, data)
+                output.comment = CBZ_COMMENT_PREFIX + encoding.encode()
+        os.replace(tmp_path, path)
+        if manifest:
+            manifest["encoding"] = encoding
+            save_manifest(path, manifest)
+        return "transcoded"
+
+    pages = page_files(path)
+    marker = path / ENCODING_MARKER
+    if (
+        not force and marker.exists() and marker.read_text(encoding="utf-8").strip() == encoding
+        and marker.stat().st_mtime >= max(p.stat().st_mtime for p in pages)
+    ):
+        return "skipped"
+    for page in pages:
+        with Image.open(page) as image:
+            data = encodeImage(image, ls_webp, compression)
+        atomic_write(page.with_suffix(suffix), data)
+        rename(page.name, page.with_suffix(suffix).name, data)
+        if page.suffix != suffix:
+            page.unlink()
+    atomic_write(marker, encoding.encode())
+    if manifest:
+        manifest["encoding"] = encoding
+        save_manifest(path, manifest)
+    return "transcoded"
+
+def check_page(data: bytes, entry: dict | None) -> str | None:
+    """Why a page is broken, `None` when it decodes and matches the hash of the manifest"""
+    if entry and entry.get("sha256") and digest(data) != entry["sha256"]:
+        return "sha256 differs from manifest"
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+    except Exception as e:
+        return repr(e)
+    return None
+
+def verify_episode(path: pathlib.Path) -> list[tuple[str, str]]:
+    """
+    `(page, reason)` of pages that cannot be fully decoded, differ from the
+    manifest written by the download, or are listed there but missing.
+    Reading a CBZ member also checks its CRC.
+    """
+    broken = list()
+    entries = load_manifest(path)["pages"]
+    if path.suffix == ".cbz":
+        try:
+            with zipfile.ZipFile(path) as cbz_file:
+                names = cbz_file.namelist()
+                for name in names:
+                    if not name.endswith(PAGE_SUFFIXES):
+                        continue
+                    try:
+                        reason = check_page(cbz_file.read(name), entries.get(name))
+                    except Exception as e:
+                        reason = repr(e)
+                    if reason:
+                        broken.append((name, reason))
+        except zipfile.BadZipFile as e:
+            return [("", repr(e))]
+    else:
+        names = [page.name for page in page_files(path)]
+        for name in names:
+            reason = check_page((path / name).read_bytes(), entries.get(name))
+            if reason:
+                broken.append((name, reason))
+    broken.extend((name, "missing") for name in sorted(entries) if name not in names)
+    return broken
+
+def repair_episode(path: pathlib.Path, names: list[str], clients: dict) -> list[str]:
+    """
+    Fetch the broken pages of one episode again, the pages that are not broken are not requested
+
+    Signed URLs come from `book_contentsInfo` restricted to each run of adjacent
+    broken pages. Pages not in the manifest cannot be located and are left as is.
+    """
+    manifest = load_manifest(path)
+    entries = {name: manifest["pages"][name] for name in names if name in manifest["pages"]}
+    if not entries or not manifest.get("comici_viewer_id"):
+        return list()
+    if manifest["host"] not in clients:
+        clients[manifest["host"]] = ComiciClient(host=manifest["host"])
+    comici_client = clients[manifest["host"]]
+    ls_webp, compression, max_size = PageStore.parse_encoding(manifest["encoding"])
+
+    manager = ContentsInfoManager(comici_client, manifest["comici_viewer_id"], comici_client.user_id, comici_client.response_cache_dir)
+    runs: list[list[int]] = list()
+    for sort in sorted(entry["sort"] for entry in entries.values()):
+        if runs and runs[-1][1] == sort - 1:
+            runs[-1][1] = sort
+        else:
+            runs.append([sort, sort])
+    for low, high in runs:
+        manager.get(low, high)
+
+    context = comici_client.request_context(manifest["episode_id"])
+    pages = dict()
+    for name, entry in entries.items():
+        contents = manager.pages[entry["sort"]]
+        raw = comici_client.get_image(contents, context)
+        image = ComiciClient.descramble_image(raw, contents.scramble, max_size)
+        pages[name] = encodeImage(image, ls_webp, compression)
+        image.close()
+        manifest["pages"][name] = page_entry(entry["sort"], digest(pages[name]), len(pages[name]), digest(raw))
+
+    if path.suffix == ".cbz":
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with zipfile.ZipFile(path) as cbz_file, zipfile.ZipFile(tmp_path, "w") as output:
+            for name in cbz_file.namelist():
+                if name not in pages:
+                    output.writestr(cbz_file.getinfo(name), cbz_file.read(name))
+            for name in sorted(pages):
+                output.writestr(name, pages[name])
+            output.comment = cbz_file.comment
+        os.replace(tmp_path, path)
+    else:
+        for name, data in pages.items():
+            atomic_write(path / name, data)
+    save_manifest(path, manifest)
+    return sorted(pages)
+
+def run_pool(func, items: list, workers: int, description: str, *args) -> list:
+    if not items:
+        console.print("[yellow]Nothing to do[/]")
+        return list()
+    results = list()
+    with concurrent.futures.ProcessPoolExecutor(workers if workers else None) as executor:
+        futures = {executor.submit(func, item, *args): item for item in items}
+        for future in track(concurrent.futures.as_completed(futures), description, total=len(futures), console=console):
+            try:
+                results.append((futures[future], future.result()))
+            except Exception as e:
+                console.print(f"[red]{futures[future]}: {e!r}[/]")
+                results.append((futures[future], e))
+    return results
+
+@app.command()
+def repack(
+    save_dir: str = typer.Argument(help="Directory given as `--save-dir` to the download commands"),
+    remove_source: bool = typer.Option(False, help="Delete the page directory after packing"),
+    workers: int = typer.Option(0, min = 0, help="Processes, 0: one per CPU"),
+):
+    """Pack episode directories into CBZ files"""
+    directories, _ = find_episodes(pathlib.Path(save_dir))
+    results = run_pool(repack_episode, directories, workers, "Repacking", remove_source)
+    repacked = sum(1 for _, result in results if result == "repacked")
+    console.print(f"[green]Repacked {repacked} episodes, {len(results) - repacked} skipped or failed[/]")
+
+@app.command()
+def transcode(
+    save_dir: str = typer.Argument(help="Directory given as `--save-dir` to the download commands"),
+    ls_webp: bool = typer.Option(False, help="Use lossless WebP instead of PNG"),
+    compression: int = typer.Option(1, min = 0, max = 9, help="Compression level, PNG max: 9, WebP max: 6"),
+    force: bool = typer.Option(False, help="Also transcode episodes already in this encoding"),
+    workers: int = typer.Option(0, min = 0, help="Processes, 0: one per CPU"),
+):
+    """Re-encode pages of episode directories and CBZ files, e.g. PNG to lossless WebP"""
+    directories, cbz_files = find_episodes(pathlib.Path(save_dir))
+    results = run_pool(transcode_episode, directories + cbz_files, workers, "Transcoding", ls_webp, compression, force)
+    transcoded = sum(1 for _, result in results if result == "transcoded")
+    console.print(f"[green]Transcoded {transcoded} episodes, {len(results) - transcoded} skipped or failed[/]")
+
+@app.command()
+def verify(
+    save_dir: str = typer.Argument(help="Directory given as `--save-dir` to the download commands"),
+    repair: bool = typer.Option(False, help="Download the broken pages again, needs the manifest written by the download"),
+    workers: int = typer.Option(0, min = 0, help="Processes, 0: one per CPU"),
+):
+    """Decode every page of episode directories and CBZ files and check it against the manifest, list the broken ones"""
+    directories, cbz_files = find_episodes(pathlib.Path(save_dir))
+    results = run_pool(verify_episode, directories + cbz_files, workers, "Verifying")
+    broken = {path: result for path, result in results if isinstance(result, list) and result}
+    for path, pages in broken.items():
+        for name, reason in pages:
+            console.print(f"[red]{path}{':' + name if path.suffix == '.cbz' and name else '/' + name if name else ''} ({reason})[/]")
+    count = sum(len(pages) for pages in broken.values())
+
+    if repair and broken:
+        clients = dict()
+        for path, pages in track(broken.items(), "Repairing", console=console):
+            try:
+                repaired = repair_episode(path, [name for name, _ in pages if name], clients)
+            except Exception as e:
+                console.print(f"[red]{path}: {e!r}[/]")
+                continue
+            count -= len(repaired)
+            if len(repaired) < len(pages):
+                console.print(f"[yellow]{path}: {len(pages) - len(repaired)} pages cannot be repaired without a manifest entry[/]")
+        console.print(f"[green]Repaired {sum(len(pages) for pages in broken.values()) - count} pages[/]")
+
+    if count:
+        console.print(f"[red]{count} broken pages in {len(results)} episodes[/]")
+        raise typer.Exit(1)
+    console.print(f"[green]{len(results)} episodes OK[/]")
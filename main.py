@@ -1,21 +1,112 @@
 from client import ComiciClient
-from utils import getLegalPath
-import typer, pathlib, time, config, zipfile, asyncio
+from contents import ContentsInfoManager
+from store import PageStore
+from structs import EpisodeJob, MangaEpisodeItem, MangaStoreItem, Rendition
+from output import OutputFormat, RowWriter
+from jobs import open_queue, serve_coordinator, JobQueue, RemoteJobQueue, RateBudget
+from server import ServerJobs, JobProgress, JOB_OPTIONS, serve_jobs
+from proxy import PageCache, PageProxy, serve_proxy
+from planner import plan_series
+from scheduler import EpisodeScheduler, Policy, episode_jobs
+from sites import ENDPOINTS, probe_sites, save_registry, registry_path, lookup as lookup_site
+from renditions import RenditionWriter, render, decode_size, pool as write_pool
+from utils import normalizeHost, parseTarget, parseRendition
+from integrity import PageIntegrityError
+import integrity
+from tracing import tracer, span
+from profiling import Profiler
+import archive, metrics, utils
+import typer, pathlib, time, config, library, asyncio, httpx, os, socket, sys, json, threading
 from typing import Callable, Literal
 from urllib.parse import urlsplit
 from rich.console import Console
 from rich.table import Table, Column
-from rich.progress import track
+from rich.progress import track, Progress
 
 app = typer.Typer(rich_markup_mode="markdown")
 app.add_typer(config.app, name="config")
+app.add_typer(library.app, name="library")
 
 client: ComiciClient | None = None
 console = Console()
+err_console = Console(stderr=True)
 
 event_loop = None
 
 ACCESSABLE_SYMBOLS = ("閲覧期限", "無料", "今なら無料", "HAS")
+THUMBNAIL_SIZE = (320, 320)
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    trace: str = typer.Option("", help="Write a Chrome trace-event JSON of every download stage to this path"),
+    stats: bool = typer.Option(False, help="Print p50/p95/total time per download stage when finished"),
+    profile: str = typer.Option("", help="Profile the command, writes `<PROFILE>.pstats` and `<PROFILE>.collapsed.txt`"),
+    profile_mode: Literal["deterministic", "sampling"] = typer.Option(
+        "deterministic", help="deterministic: cProfile + stack sampling, sampling: stack sampling only (no pstats)"
+    ),
+    profile_filter: str = typer.Option("", help="Only keep these modules in the profile, e.g. `client,main`"),
+    profile_interval: float = typer.Option(0.005, min = 0.0001, help="Stack sampling interval in seconds"),
+    metrics_port: int = typer.Option(0, min = 0, help="Serve Prometheus metrics on http://127.0.0.1:<PORT>/metrics"),
+    metrics_snapshot: str = typer.Option("", help="Periodically write a JSON snapshot of the metrics to this path"),
+    metrics_interval: float = typer.Option(10.0, min = 0.1, help="Seconds between metrics snapshots"),
+    png_threads: int = typer.Option(1, min = 1, help="Threads deflating each PNG page (pigz-style), pays off from `--compression 6`"),
+    writers: int = typer.Option(4, min = 1, help="Threads writing pages to disk"),
+    write_queue: int = typer.Option(64, min = 1, help="Encoded pages waiting for a writer before downloads pause"),
+    fsync: Literal["page", "episode", "never"] = typer.Option(
+        "never", help="page: fsync every page, episode: fsync when an episode is finished, never: leave it to the OS"
+    ),
+    record: str = typer.Option("", help="Record every request and response of the Comici clients to this archive directory"),
+    replay: str = typer.Option("", help="Answer requests from an archive of `--record`, without any network access"),
+    replay_timing: bool = typer.Option(False, help="Wait the recorded response time before every replayed response"),
+):
+    utils.PNG_THREADS = png_threads
+    write_pool.configure(writers, write_queue, fsync)
+    if record and replay:
+        raise typer.BadParameter("--record and --replay cannot be used together")
+    if record or replay:
+        try:
+            archive.active = archive.HttpArchive(record or replay, "record" if record else "replay", replay_timing)
+        except FileNotFoundError as e:
+            raise typer.BadParameter(str(e), param_hint="--replay")
+        ctx.call_on_close(archive.active.close)
+        if replay:
+            console.print(f"[green]Replaying {len(archive.active)} responses from '{replay}'[/]")
+    if trace or stats:
+        tracer.enable()
+        ctx.call_on_close(lambda: finish_trace(trace, stats))
+    if profile:
+        profiler = Profiler(
+            profile,
+            profile_mode,
+            {m.strip() for m in profile_filter.split(",") if m.strip()} or None,
+            profile_interval
+        )
+        profiler.start()
+        ctx.call_on_close(lambda: finish_profile(profiler))
+    if metrics_port or metrics_snapshot:
+        metrics.registry.enabled = True
+        tracer.add_listener(metrics.observe_span)
+        if metrics_port:
+            metrics.registry.serve(metrics_port)
+            console.print(f"[green]Serving metrics on http://127.0.0.1:{metrics_port}/metrics[/]")
+        if metrics_snapshot:
+            stop_snapshots = metrics.registry.snapshot_periodically(metrics_snapshot, metrics_interval)
+            ctx.call_on_close(lambda: (stop_snapshots.set(), metrics.registry.write_snapshot(metrics_snapshot)))
+
+def finish_profile(profiler: Profiler):
+    for path in profiler.stop():
+        console.print(f"[green]Profile written to '{path}'[/]")
+
+def finish_trace(trace: str, stats: bool):
+    if trace:
+        tracer.dump(trace)
+        console.print(f"[green]Trace written to '{trace}'[/]")
+    if stats:
+        table = Table("Stage", "Count", "p50 (ms)", "p95 (ms)", "Total (ms)", title="Stage Timings")
+        for name, count, p50, p95, total in tracer.summary():
+            table.add_row(name, str(count), f"{p50:.1f}", f"{p95:.1f}", f"{total:.1f}")
+        console.print(table)
 
 def client_init():
     global client
@@ -38,18 +129,53 @@ def user():
     console.print(f"[green]You are accessing site: {client.HOST} {'(NEW Comici+)' if client.NEW_VERSION else ''}[/]")
 
 @app.command()
-def sites():
-    """All supported sites listed on https://comici.co.jp/business/comici-plus"""
+def sites(
+    probe: bool = typer.Option(False, help="Check every site concurrently and save the results to `<cache_dir>/sites.json`"),
+    host: list[str] = typer.Option([], help="Probe these hosts instead of the listed sites, can be repeated"),
+    concurrency: int = typer.Option(8, min = 1, help="Sites probed at the same time"),
+    timeout: float = typer.Option(10.0, min = 0.1, help="Seconds before a request of the probe fails"),
+):
+    """
+    All supported sites listed on https://comici.co.jp/business/comici-plus
+
+    With `--probe` every site is checked for reachability, latency, version and API endpoints.
+    Clients then take the version from the results instead of requesting the site first,
+    and `download-batch` skips sites that were unreachable.
+    """
     client_init()
-    console.print(client.get_all_support_sites())
+    if not probe:
+        console.print(client.get_all_support_sites())
+        return
+
+    hosts = list(dict.fromkeys(normalizeHost(h) for h in (host if host else client.get_all_support_sites())))
+    console.print(f"[yellow]Probing {len(hosts)} sites[/]")
+    probes = asyncio.run(probe_sites(hosts, concurrency, timeout, client.USER_AGENT_DEFAULT, client.PROXY_DEFAULT))
+
+    table = Table("Host", "Reachable", "Status", "Latency (ms)", "Version", *ENDPOINTS, "Error", title="Sites")
+    for result in probes:
+        table.add_row(
+            result.host,
+            "[green]yes[/]" if result.reachable else "[red]no[/]",
+            str(result.status or ""),
+            f"{result.latency * 1000:.0f}" if result.latency is not None else "",
+            "" if result.new_version is None else "Comici+" if result.new_version else "old",
+            *["" if name not in result.endpoints else "[green]yes[/]" if result.endpoints[name] else "[red]no[/]" for name in ENDPOINTS],
+            result.error,
+        )
+    console.print(table)
+    if client.CACHE_DIR_DEFAULT:
+        save_registry(client.CACHE_DIR_DEFAULT, probes)
+        console.print(f"[green]Saved to '{registry_path(client.CACHE_DIR_DEFAULT)}'[/]")
 
 @app.command()
 def bookshelf(
     page: int = typer.Option(0, min = 0, help="Page number when too many bookshelf items to show"),
     bookshelf_type: Literal["", "favorite", "buying", "liking"] = typer.Option("", "--type", help="== [閲覧, お気に入り, レンタル, いいね]"),
     cookies: str = typer.Option("", help="Path to your cookies.json, should use Cookie-Editor JSON format"),
+    output: OutputFormat = typer.Option("table", help="table, or one row per line as soon as it is parsed: jsonl / csv / tsv"),
 ):
     client_init()
+    out = console if output == "table" else err_console
     if cookies: 
         client.update_cookies_from_CookieEditorJson(cookies)
     results, has_next_page = client.api_bookshelf(
@@ -60,9 +186,21 @@ def bookshelf(
         bookshelf_type=bookshelf_type
     )
     if not results:
-        console.print("[red]No results[/]")
+        out.print("[red]No results[/]")
         typer.Abort()
         return
+
+    if output != "table":
+        writer = RowWriter(output, ["series_id", "title", "last_update"])
+        for result in results:
+            writer.write(
+                series_id=urlsplit(result.href).path.rstrip("/").split("/")[-1],
+                title=result.title,
+                last_update=result.last_update,
+            )
+        if has_next_page: 
+            out.print(f"[yellow]There are more bookshelf items, use `--page {page+1}` to show them[/]")
+        return
     
     table = Table(
         "Series ID", 
@@ -86,18 +224,26 @@ def bookshelf(
 def author(
     author_id: str,
     page: int = typer.Option(0, min = 0, help="Page number when too many series to show"),
+    output: OutputFormat = typer.Option("table", help="table, or one row per line as soon as it is parsed: jsonl / csv / tsv"),
 ):
     """List series of a author by author_id, only some sites support this"""
     client_init()
+    out = console if output == "table" else err_console
     results, has_next_page = client.author(
         author_id=author_id, 
         page=page
     )
     if not results:
-        console.print("[red]No results[/]")
+        out.print("[red]No results[/]")
         typer.Abort()
         return
 
+    if output != "table":
+        write_series_rows(output, results)
+        if has_next_page: 
+            out.print(f"[yellow]There are more series, use `--page {page+1}` to show them[/]")
+        return
+
     table = Table(
         "Series ID", 
         Column("Title", overflow="fold"), 
@@ -122,18 +268,26 @@ def author(
 def series_list(
     sort: Literal["更新順", "新作順"] = "更新順",
     page: int = typer.Option(0, min = 0, help="Page number when too many series to show"),
+    output: OutputFormat = typer.Option("table", help="table, or one row per line as soon as it is parsed: jsonl / csv / tsv"),
 ):
     """List all series on the site"""
     client_init()
+    out = console if output == "table" else err_console
     results, has_next_page = client.series_list(
         sort=sort, 
         page=page,
     )
     if not results:
-        console.print("[red]No results[/]")
+        out.print("[red]No results[/]")
         typer.Abort()
         return
 
+    if output != "table":
+        write_series_rows(output, results)
+        if has_next_page: 
+            out.print(f"[yellow]There are more series, use `--page {page+1}` to show them[/]")
+        return
+
     has_author_ids = False
     for result in results:
         for author in result.author: 
@@ -177,8 +331,10 @@ def search(
     _filter: Literal["series", "seriesofauthors", "articles"] = typer.Option(
         "series", "--filter", help="Filter type. Articles == Episodes"
     ),
+    output: OutputFormat = typer.Option("table", help="table, or one row per line as soon as it is parsed: jsonl / csv / tsv"),
 ):
     client_init()
+    out = console if output == "table" else err_console
     if not client.NEW_VERSION: 
         results, has_next_page = client.search(
             keyword,
@@ -187,8 +343,8 @@ def search(
             _filter=_filter
         )
     else:
-        console.print("[yellow]You are accessing site that using new version Comici[/]")
-        console.print("[yellow]This progress may take more time[/]")
+        out.print("[yellow]You are accessing site that using new version Comici[/]")
+        out.print("[yellow]This progress may take more time[/]")
         results, has_next_page = client.api_search(
             keyword,
             page=page + 1, 
@@ -196,9 +352,20 @@ def search(
             _filter=_filter
         )
     if not results:
-        console.print("[red]No results[/]")
+        out.print("[red]No results[/]")
         typer.Abort()
         return
+
+    if output != "table":
+        if _filter == "articles":
+            writer = RowWriter(output, ["episode_id", "title"])
+            for result in results:
+                writer.write(episode_id=urlsplit(result.href).path.rstrip("/").split("/")[-1], title=result.title)
+        else:
+            write_series_rows(output, results)
+        if has_next_page: 
+            out.print(f"[yellow]There are more results, use `--page {page+1}` and `--size` to show more[/]")
+        return
     
     if _filter == "articles":
         table = Table(
@@ -249,6 +416,20 @@ def search(
     if has_next_page: 
         console.print(f"[yellow]There are more results, use `--page {page+1}` and `--size` to show more[/]")
 
+def write_series_rows(output: OutputFormat, results: list[MangaStoreItem]):
+    writer = RowWriter(output, ["series_id", "title", "authors", "author_ids"])
+    for result in results:
+        writer.write(
+            series_id=urlsplit(result.href).path.rstrip("/").split("/")[-1],
+            title=result.title,
+            authors=[author.name for author in result.author],
+            author_ids=[urlsplit(author.href).path.rstrip("/").split("/")[-1] if author.href else "" for author in result.author],
+        )
+
+def host_client(host: str, cookies: str = "") -> ComiciClient:
+    """Client of another site, with the same `--cookies` as the global client"""
+    return ComiciClient(host=host, cookies=pathlib.Path(cookies) if cookies else None)
+
 def load_cookies(cookies: str = ""):
     client_init()
     global client
@@ -270,6 +451,7 @@ def episodes(
     limit: int = typer.Option(50, min = 0, help="Limit of episodes to show"), 
     cookies: str = typer.Option("", help="Path to your cookies.json, should use Cookie-Editor JSON format"), 
     bought_only: bool = typer.Option(True, help="Only show bought episodes"),
+    output: OutputFormat = typer.Option("table", help="table, or one row per line as soon as it is parsed: jsonl / csv / tsv"),
 ):
     """
     Show episodes in target series
@@ -278,6 +460,7 @@ def episodes(
     """
     client_init()
     load_cookies(cookies)
+    out = console if output == "table" else err_console
     
     if not client.NEW_VERSION: 
         paging_list, has_next_page = client.series_pagingList(
@@ -287,8 +470,8 @@ def episodes(
             limit=limit
         )
     else:
-        console.print("[yellow]You are accessing site that using new version Comici[/]")
-        console.print("[yellow]This progress may take more time[/]")
+        out.print("[yellow]You are accessing site that using new version Comici[/]")
+        out.print("[yellow]This progress may take more time[/]")
         paging_list, has_next_page = client.new_series_pagingList(
             series_id=series_id,
             sort=sort, 
@@ -296,6 +479,22 @@ def episodes(
             limit=limit
         )
 
+    if output != "table":
+        writer = RowWriter(output, ["episode_id", "title", "symbols", "update_date"])
+        for episode in paging_list:
+            if bought_only:
+                if not episode.href: continue
+                elif not episode.symbols[0].split("\n")[0] in ACCESSABLE_SYMBOLS:
+                    continue
+            writer.write(
+                episode_id=urlsplit(episode.href).path.rstrip("/").split("/")[-1] if episode.href else None,
+                title=episode.title,
+                symbols=episode.symbols if not hasattr(episode, "accessType") else [episode.accessType],
+                update_date=episode.update_date,
+            )
+        if has_next_page: 
+            out.print(f"[yellow]There are more episodes, use `--page {page+1}` and `--limit` to show more[/]")
+        return
     
     table = Table(
         "Episode ID", 
@@ -321,14 +520,18 @@ def episodes(
         console.print(f"[yellow]There are more episodes, use `--page {page+1}` and `--limit` to show more[/]")
 
 @app.command("detailed-episodes")
-def detailed_episodes(episode_id: str):
+def detailed_episodes(
+    episode_id: str,
+    output: OutputFormat = typer.Option("table", help="table, or one row per line as soon as it is parsed: jsonl / csv / tsv"),
+):
     """
     Show detailed info of all episodes in the series, but need one of episode_id to request
     """
     client_init()
+    out = console if output == "table" else err_console
     comici_viewer_id, series_id = client.episodes(episode_id=episode_id)
     if not comici_viewer_id: 
-        console.print(f"[red]Cannot access episode {episode_id}[/]")
+        out.print(f"[red]Cannot access episode {episode_id}[/]")
         typer.Abort()
         return
     
@@ -338,6 +541,19 @@ def detailed_episodes(episode_id: str):
         book_info = client.book_info(comici_viewer_id)
         episode_info = client.book_episodeInfo(comici_viewer_id)
 
+    if output != "table":
+        writer = RowWriter(output, ["id", "name", "page_count", "episode_number", "publish_date", "end_date"])
+        for episode in episode_info:
+            writer.write(
+                id=episode._id,
+                name=episode.name,
+                page_count=episode.page_count,
+                episode_number=episode.episode_number,
+                publish_date=episode.publish_date,
+                end_date=episode.end_date if episode.end_date and episode.end_date.year < 9999 else None,
+            )
+        return
+
     table = Table(
         "Episode ID" if client.NEW_VERSION else "Comici Viewer ID", 
         Column("Title", overflow="fold"), 
@@ -377,13 +593,50 @@ def download_episode(
     ls_webp: bool = typer.Option(False, help="Use lossless WebP instead of PNG"),
     compression: int = typer.Option(1, min = 0, max = 9, help="Compression level, PNG max: 9, WebP max: 6"),
     threads: int = typer.Option(1, min = 1, help="Download thread count"),
+    store: str = typer.Option("", help="Content-addressed page store directory, reuses pages already downloaded from any site"),
+    max_width: int = typer.Option(0, min = 0, help="Scale pages down to this width, JPEG pages are decoded at reduced scale. 0: no limit"),
+    max_height: int = typer.Option(0, min = 0, help="Scale pages down to this height. 0: no limit"),
+    thumbnails: bool = typer.Option(False, help=f"Also save {THUMBNAIL_SIZE[0]}px JPEG thumbnails to `thumbnails/`, beside a CBZ to `<episode>.thumbnails/`"),
+    rendition: list[str] = typer.Option([], help="Output `<dir|cbz>:<png|webp>[:<compression>][:<W>x<H>][@<save_dir>]`, repeat for several outputs from one download, replaces `--cbz`/`--ls-webp`/`--compression`"),
 ):
     global event_loop
-    client_init()
-    load_cookies(cookies)
+    renditions = parse_renditions(rendition, save_dir)
+    event_loop = asyncio.get_event_loop()
+    event_loop.run_until_complete(download_episode_async(
+        episode_id=episode_id,
+        cookies=cookies,
+        page_from=page_from,
+        page_to=page_to,
+        save_dir=save_dir,
+        cbz=cbz,
+        overwrite=overwrite,
+        wait_interval=wait_interval,
+        ls_webp=ls_webp,
+        compression=compression,
+        threads=threads,
+        store=store,
+        max_width=max_width,
+        max_height=max_height,
+        thumbnails=thumbnails,
+        renditions=renditions,
+    ))
 
+def parse_renditions(specs: list[str], save_dir: str) -> list[Rendition] | None:
+    """`--rendition` options, `None` keeps the single output of `--cbz`/`--ls-webp`/`--compression`"""
+    try:
+        renditions = [parseRendition(spec, save_dir) for spec in specs]
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint="--rendition")
+    outputs = [(rendition.kind, pathlib.Path(rendition.save_dir).resolve()) for rendition in renditions]
+    if len(set(outputs)) < len(outputs):
+        raise typer.BadParameter("Outputs of the same kind need different save directories", param_hint="--rendition")
+    return renditions or None
+
+def prepare_episode(episode_id: str, page_from: int, page_to: int, comici_client: ComiciClient | None = None):
+    """Resolve IDs, metadata and signed page URLs of an episode, blocking"""
+    comici_client = comici_client if comici_client else client
     if len(episode_id) not in (13, 32):
-        if urlsplit(client.HOST).hostname in urlsplit(episode_id).hostname:
+        if urlsplit(comici_client.HOST).hostname in urlsplit(episode_id).hostname:
             episode_id = urlsplit(episode_id).path.rstrip("/").split("/")[-1]
         else:
             console.print("[red]Invalid series ID[/]")
@@ -391,7 +644,7 @@ def download_episode(
             return
     
     if len(episode_id) == 13:
-        comici_viewer_id, series_id = client.episodes(episode_id=episode_id)
+        comici_viewer_id, series_id = comici_client.episodes(episode_id=episode_id)
         if not comici_viewer_id: 
             console.print(f"[red]Cannot access episode {episode_id}[/]")
             typer.Abort()
@@ -402,9 +655,16 @@ def download_episode(
         comici_viewer_id = episode_id
         console.print(f"[green]Detected Comici Viewer ID: '{episode_id}'[/]")
 
-    if not client.NEW_VERSION: 
-        episodes_info = client.book_episodeInfo(comici_viewer_id)
-        book_info = client.book_info(comici_viewer_id)
+    contents_manager = ContentsInfoManager(
+        comici_client,
+        comici_viewer_id,
+        comici_client.user_id,
+        comici_client.response_cache_dir
+    )
+
+    if not comici_client.NEW_VERSION: 
+        episodes_info = comici_client.book_episodeInfo(comici_viewer_id)
+        book_info = comici_client.book_info(comici_viewer_id)
 
         episode_infos = [episode for episode in episodes_info if episode._id == comici_viewer_id]
         if not episode_infos: 
@@ -420,8 +680,8 @@ def download_episode(
             console.print("[red]New version Comici does not support Comici Viewer ID input[/]")
             typer.Abort()
             return
-        contents_info, page_count = client.book_contentsInfo(comici_viewer_id, 0, 0, client.user_id)
-        book_info, episode_infos = client.new_book_info_and_episode_info(series_id)
+        page_count = contents_manager.page_count()
+        book_info, episode_infos = comici_client.new_book_info_and_episode_info(series_id)
         for e_info in episode_infos:
             if e_info._id == episode_id: 
                 episode_info = e_info
@@ -434,92 +694,237 @@ def download_episode(
     page_to = page_count if page_to < 0 or page_to > page_count else page_to
     page_from = 0 if page_from < 0 or page_from > page_to else page_from
 
-    contents_info, page_count = client.book_contentsInfo(
-        comici_viewer_id, 
-        page_from, 
-        page_to, 
-        client.user_id if client.user_id else "0"
-    )
+    last_page = min(page_to, page_count - 1)
+    contents_info = contents_manager.get(page_from, last_page)
 
-    save_dir_path = pathlib.Path(save_dir)
-    save_dir_path = save_dir_path / getLegalPath(book_info.title) / getLegalPath(episode_info.name)
-    save_dir_path.mkdir(parents=True, exist_ok=True)
+    return episode_id, book_info, episode_info, contents_manager, contents_info, page_from, page_to, last_page
+
+async def download_episode_async(
+    episode_id: str,
+    cookies: str = "",
+    page_from: int = 0,
+    page_to: int = -1,
+    save_dir: str = "",
+    cbz: bool = False,
+    overwrite: bool = False,
+    wait_interval: float = 0.5,
+    ls_webp: bool = False,
+    compression: int = 1,
+    threads: int = 1,
+    store: str = "",
+    max_width: int = 0,
+    max_height: int = 0,
+    thumbnails: bool = False,
+    renditions: list[Rendition] | None = None,
+    progress: Progress | None = None,
+    comici_client: ComiciClient | None = None,
+):
+    """
+    Download one episode on the running event loop, episodes can run concurrently on one client
+
+    `renditions` replace `save_dir`, `cbz`, `ls_webp`, `compression` and the max size, every
+    page is fetched and descrambled once for all of them. Thumbnails go to the first one.
+    `comici_client` defaults to the global client, pass one per host to download from several sites at once
+    """
+    client_init()
+    load_cookies(cookies)
+    comici_client = comici_client if comici_client else client
+    store = store or comici_client.STORE_DEFAULT
+
+    prepared = await asyncio.to_thread(prepare_episode, episode_id, page_from, page_to, comici_client)
+    if not prepared:
+        return
+    episode_id, book_info, episode_info, contents_manager, contents_info, page_from, page_to, last_page = prepared
 
     filename_just = len(str(page_to)) + 1
 
-    client.SEMAPHORE = asyncio.Semaphore(threads)
+    request_context = comici_client.request_context(episode_id, semaphore=asyncio.Semaphore(threads))
+
+    page_store = PageStore(store) if store else None
+    if not renditions:
+        max_size = (max_width, max_height) if max_width or max_height else None
+        renditions = [Rendition("cbz" if cbz else "dir", ls_webp, compression, max_size, save_dir)]
+    manifest = dict(host=comici_client.HOST, episode_id=episode_id, comici_viewer_id=contents_manager.comici_viewer_id)
+    writers = [
+        RenditionWriter(rendition, book_info.title, episode_info.name, overwrite, filename_just, manifest)
+        for rendition in renditions
+    ]
+
+    def descramble(raw: bytes, contents, pending: list[RenditionWriter]):
+        image = comici_client.descramble_image(raw, contents.scramble, decode_size([w.rendition for w in pending])) if pending else None
+        thumbnail = comici_client.descramble_image(raw, contents.scramble, THUMBNAIL_SIZE) if thumbnails else None
+        return image, thumbnail
+
+    async def fetch(contents, episode_id: str):
+        contents = await contents_manager.fresh(contents, last_page)
+        try:
+            return contents, await comici_client.get_image_async(contents, request_context)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in (401, 403, 410):
+                raise
+            metrics.RETRIES.inc(reason=f"http_{e.response.status_code}")
+            contents = await contents_manager.renew(contents, last_page)
+        except PageIntegrityError:
+            metrics.RETRIES.inc(reason="integrity")
+        return contents, await comici_client.get_image_async(contents, request_context)
 
-    async def download(filepath: str, contents, episode_id: str):
-        img = await client.get_and_descramble_image_async(contents, episode_id)
+    async def download(contents, episode_id: str, needed: list[RenditionWriter]):
+        """Fetch and descramble a page once, then encode it for every rendition in parallel"""
+        for attempt in range(2):
+            contents, raw = await fetch(contents, episode_id)
+            raw_digest = integrity.digest(raw)
+            stored = {w: page_store.find(raw_digest, w.encoding) for w in needed} if page_store else dict()
+            pending = [w for w in needed if not stored.get(w)]
+            try:
+                image, thumbnail = await asyncio.to_thread(descramble, raw, contents, pending)
+                break
+            except PageIntegrityError:
+                if attempt:
+                    raise
+                metrics.RETRIES.inc(reason="integrity")
+
+        def encode(writer: RenditionWriter) -> bytes | pathlib.Path:
+            data = render(image, writer.rendition)
+            if not page_store:
+                return data
+            with span("store.put"):
+                return page_store.put(raw_digest, writer.encoding, data)
+
+        outputs = await asyncio.gather(*[asyncio.to_thread(encode, w) for w in pending])
+        if image:
+            image.close()
+        if page_store:
+            page_store.remember(contents.imageUrl, contents.width, contents.height, raw_digest)
         await asyncio.sleep(wait_interval)
-        return filepath, img
+        return contents.sort, raw_digest, {**stored, **dict(zip(pending, outputs))}, thumbnail
 
     async def donwloader():
-        if cbz:
-            cbz_file_path = save_dir_path.parent / f"{getLegalPath(episode_info.name)}.cbz"
-            cbz_file = zipfile.ZipFile(
-                str(cbz_file_path),
-                "a" if cbz_file_path.exists() and not overwrite else "w"
-            )
-
         tasks = []
+        reused = 0
 
-        for contents in contents_info:
-            filename = "{}.{}".format(
-                str(contents.sort + 1).rjust(filename_just, '0'),
-                "webp" if ls_webp else "png"
-            )
+        try:
+            for contents in ContentsInfoManager.schedule(contents_info):
+                needed = [w for w in writers if w.needs(contents.sort)]
 
-            save_full_path = save_dir_path / filename
-            if save_full_path.exists():
-                if cbz:
-                    if cbz_file.mode == "a":
-                        if filename in cbz_file.namelist(): continue
-                    cbz_file.write(save_full_path, filename)
-                    save_full_path.unlink(missing_ok=True)
+                if page_store and needed:
+                    for w in list(needed):
+                        object_path = page_store.lookup(contents.imageUrl, contents.width, contents.height, w.encoding)
+                        if object_path:
+                            await w.put(contents.sort, object_path)
+                            needed.remove(w)
+                    if not needed:
+                        metrics.PAGES.inc(result="reused")
+                        reused += 1
+                if not needed:
                     continue
-                if not overwrite: continue
-            else:
-                if cbz and cbz_file.mode == "a" and filename in cbz_file.namelist(): continue
 
-            tasks.append(
-                asyncio.create_task(download(filename if cbz else save_full_path, contents, episode_id))
-            )
+                if not tasks and comici_client.WARMUP_DEFAULT:
+                    await comici_client.warmup_async(contents.imageUrl, threads, request_context)
 
-        if tasks:
-            console.print(f"[yellow] Downloading '{episode_info.name}' ({len(contents_info)} Pages) of '{book_info.title}'[/]")
-            for task in track(asyncio.as_completed(tasks), "Please wait", total=len(tasks)):
-                filepath, image = await task
-                if cbz:
-                    with cbz_file.open(filepath, "w") as f:
-                        if ls_webp:
-                            image.save(f, "WEBP", lossless=True, method=compression if compression <= 6 else 6)
-                        else:
-                            image.save(f, "PNG", compress_level=compression)
-                else:
-                    if ls_webp:
-                        image.save(filepath, "WEBP", lossless=True, method=compression if compression <= 6 else 6)
-                    else:
-                        image.save(filepath, "PNG", compress_level=compression)
-                image.close()
+                tasks.append(asyncio.create_task(download(contents, episode_id, needed)))
 
-        if cbz:
-            cbz_file.close()
-            if save_dir_path.exists(): 
+            if reused:
+                console.print(f"[green] Reused {reused} pages from store '{store}'[/]")
+
+            if tasks:
+                console.print(f"[yellow] Downloading '{episode_info.name}' ({len(contents_info)} Pages) of '{book_info.title}'[/]")
+                if progress:
+                    progress_task = progress.add_task(episode_info.name, total=len(tasks))
+                    completed = asyncio.as_completed(tasks)
+                else:
+                    completed = track(asyncio.as_completed(tasks), "Please wait", total=len(tasks))
+                metrics.QUEUE_DEPTH.inc(len(tasks))
+                consumed = 0
                 try:
-                    save_dir_path.rmdir()
-                except:
-                    pass
-            console.print(f"[green] Downloaded {page_to - page_from + 1} pages to '{cbz_file_path}'[/]")
-        else:
-            console.print(f"[green] Downloaded {page_to - page_from + 1} pages to '{save_dir_path}'[/]")
+                    for task in completed:
+                        sort, raw_digest, outputs, thumbnail = await task
+                        consumed += 1
+                        metrics.QUEUE_DEPTH.dec()
+                        metrics.PAGES.inc(result="downloaded")
+                        if progress:
+                            progress.advance(progress_task)
+                        if thumbnail:
+                            await writers[0].put_thumbnail(sort, thumbnail)
+                        for writer, output in outputs.items():
+                            await writer.put(sort, output, raw_digest)
+                except BaseException:
+                    if progress:
+                        progress.remove_task(progress_task)
+                    raise
+                finally:
+                    # pages not consumed, whether the episode finished, was cancelled or a page failed
+                    metrics.QUEUE_DEPTH.dec(len(tasks) - consumed)
+        finally:
+            # preempted by the episode scheduler or a page failed: keep the pages written so far, a later run resumes
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            closed = await asyncio.gather(*[writer.close() for writer in writers], return_exceptions=True)
+            if page_store:
+                page_store.close()
 
-    event_loop = asyncio.get_event_loop()
-    event_loop.run_until_complete(donwloader())
+        for path in closed:
+            if isinstance(path, BaseException):
+                raise path
+            console.print(f"[green] Downloaded {page_to - page_from + 1} pages to '{path}'[/]")
+
+    await donwloader()
+    return True
+
+def list_series_episodes(series_id: str, comici_client: ComiciClient | None = None) -> list[MangaEpisodeItem]:
+    """Every page of the paging list of a series"""
+    comici_client = comici_client if comici_client else client
+    page = 0
+
+    if not comici_client.NEW_VERSION:
+        series_pagingList: Callable = comici_client.series_pagingList
+    else:
+        series_pagingList: Callable = comici_client.new_series_pagingList
+
+    paging_list, has_next_page = series_pagingList(
+        series_id=series_id,
+    )
+
+    while has_next_page:
+        page += 1
+        paging_list_cache, has_next_page = series_pagingList(
+            series_id=series_id,
+            page=page,
+        )
+        paging_list.extend(paging_list_cache)
+    return paging_list
+
+def format_bytes(size: int | None) -> str:
+    if size is None:
+        return "unknown"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+def print_plan(report: dict):
+    table = Table("Episode", "Pages", "On disk", title="Episodes")
+    for episode in report["episode_plans"]:
+        table.add_row(episode["title"], str(episode["pages"]), str(episode["present"]))
+    console.print(table)
+
+    seconds = report["estimated_seconds"]
+    table = Table("Estimate", "Value", title=f"Plan for {report['host']}")
+    table.add_row("Episodes", f"{report['episodes']} ({report['unavailable']} unavailable)")
+    table.add_row("Pages", f"{report['pages_to_fetch']} to fetch, {report['pages_present']} on disk")
+    table.add_row("Requests", f"{report['requests']['total']} ({report['requests']['api']} API, {report['requests']['cdn']} CDN)")
+    table.add_row("Transfer", f"{format_bytes(report['transfer_bytes'])} ({report['sampled_pages']} pages sampled)")
+    for output, size in report["disk_bytes"].items():
+        fits = report["fits_on_disk"].get(output)
+        table.add_row(f"Disk ({output}, also CBZ)", f"{format_bytes(size)}{'' if fits is None else ' fits' if fits else ' [red]exceeds free space[/]'}")
+    table.add_row("Free disk", format_bytes(report["free_disk_bytes"]))
+    table.add_row("Time", "unknown" if seconds is None else time.strftime("%H:%M:%S", time.gmtime(seconds)) if seconds < 86400 else f"{seconds / 86400:.1f} days")
+    console.print(table)
 
 @app.command("download-series")
 def download_series(
-    series_id: str = typer.Argument(help="Series ID (13 chars) / full URL of series"), 
+    series_ids: list[str] = typer.Argument(help="Series ID (13 chars) / full URL of series, several series are downloaded together", metavar="SERIES_ID..."),
     cookies: str = "",
     save_dir: str = "",
     cbz: bool = typer.Option(False, help="Save as CBZ file"),
@@ -528,50 +933,71 @@ def download_series(
     ls_webp: bool = typer.Option(False, help="Use lossless WebP instead of PNG"),
     compression: int = typer.Option(1, min = 0, max = 9, help="Compression level, PNG max: 9, WebP max: 6"),
     allow_mismatch: bool = typer.Option(False, help="Allow mismatch hostname"),
-    threads: int = typer.Option(1, min = 1, help="Download thread count")
+    threads: int = typer.Option(1, min = 1, help="Download thread count"),
+    store: str = typer.Option("", help="Content-addressed page store directory, reuses pages already downloaded from any site"),
+    max_width: int = typer.Option(0, min = 0, help="Scale pages down to this width, JPEG pages are decoded at reduced scale. 0: no limit"),
+    max_height: int = typer.Option(0, min = 0, help="Scale pages down to this height. 0: no limit"),
+    thumbnails: bool = typer.Option(False, help=f"Also save {THUMBNAIL_SIZE[0]}px JPEG thumbnails to `thumbnails/`, beside a CBZ to `<episode>.thumbnails/`"),
+    rendition: list[str] = typer.Option([], help="Output `<dir|cbz>:<png|webp>[:<compression>][:<W>x<H>][@<save_dir>]`, repeat for several outputs from one download, replaces `--cbz`/`--ls-webp`/`--compression`"),
+    episode_concurrency: int = typer.Option(1, min = 1, help="Episodes downloaded at the same time, sharing one CDN connection pool"),
+    plan: bool = typer.Option(False, help="Only estimate requests, bytes, disk space and time, no page is downloaded"),
+    plan_sample: int = typer.Option(5, min = 0, help="Pages whose first bytes are requested for sizes and throughput with `--plan`"),
+    plan_json: str = typer.Option("", help="Also write the `--plan` report as JSON to this path"),
+    order: Policy = typer.Option(
+        "paging", help="paging: paging list order, newest: newest first, expiring: access window (閲覧期限) closing soonest first, smallest: fewest pages first, round-robin: one episode of every series in turn"
+    ),
+    preempt_within: float = typer.Option(0, min = 0, help="Hours, an episode whose access window closes sooner pauses the lowest ranked running one. 0: never"),
 ):
+    global event_loop
+    renditions = parse_renditions(rendition, save_dir)
     client_init()
     load_cookies(cookies)
 
-    if len(series_id) != 13:
-        if urlsplit(client.HOST).hostname in urlsplit(series_id).hostname:
-            series_id = urlsplit(series_id).path.rstrip("/").split("/")[-1]
-        else:
-            if urlsplit(client.HOST).hostname not in urlsplit(series_id).hostname:
-                if allow_mismatch:
-                    client.HOST = "https://" + urlsplit(series_id).hostname
-                    series_id = urlsplit(series_id).path.rstrip("/").split("/")[-1]
-                    console.print(f"[yellow]Hostname mismatch, using '{urlsplit(series_id).hostname}'[/]")
-                else:
-                    console.print(f"[red]Invalid series ID: Hostname mismatch[/]")
-                    typer.Abort()
-                    return
-            else:
-                console.print("[red]Invalid series ID[/]")
-                typer.Abort()
-                return
-
-    console.print(f"[green]Downloading series '{series_id}'[/]")
-
-    page = 0
-
-    if not client.NEW_VERSION:
-        series_pagingList: Callable = client.series_pagingList
-    else:
-        series_pagingList: Callable = client.new_series_pagingList
+    series_ids = [resolve_series_id(series_id, allow_mismatch) for series_id in series_ids]
+    if None in series_ids:
+        return
+    accessible = lambda episode: bool(episode.href) and episode.symbols[0].split("\n")[0] in ACCESSABLE_SYMBOLS
 
-    paging_list, has_next_page = series_pagingList(
-        series_id=series_id,
-    )
+    if plan:
+        paging_list = [episode for series_id in series_ids for episode in list_series_episodes(series_id)]
+        console.print(f"[green] Found {len(paging_list)} episodes[/]")
+        episodes = [
+            (urlsplit(episode.href).path.rstrip("/").split("/")[-1], episode.title) for episode in paging_list
+            if accessible(episode)
+        ]
+        max_size = (max_width, max_height) if max_width or max_height else None
+        report = plan_series(
+            client, episodes, renditions or [Rendition("cbz" if cbz else "dir", ls_webp, compression, max_size, save_dir)],
+            plan_sample, threads, episode_concurrency, len(paging_list) - len(episodes)
+        )
+        print_plan(report)
+        if plan_json:
+            pathlib.Path(plan_json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+            console.print(f"[green]Plan written to '{plan_json}'[/]")
+        return
 
-    while has_next_page:
-        page += 1
-        paging_list_cache, has_next_page = series_pagingList(
-            series_id=series_id,
-            page=page,
+    if len(series_ids) > 1 or order != "paging" or preempt_within or episode_concurrency > 1:
+        download_scheduled(
+            series_ids, accessible, order, preempt_within, episode_concurrency,
+            dict(
+                save_dir=save_dir,
+                cbz=cbz,
+                ls_webp=ls_webp,
+                compression=compression,
+                wait_interval=wait_interval,
+                overwrite=overwrite,
+                threads=threads,
+                store=store,
+                max_width=max_width,
+                max_height=max_height,
+                thumbnails=thumbnails,
+                renditions=renditions,
+            ),
         )
-        paging_list.extend(paging_list_cache)
+        return
 
+    console.print(f"[green]Downloading series '{series_ids[0]}'[/]")
+    paging_list = list_series_episodes(series_ids[0])
     console.print(f"[green] Found {len(paging_list)} episodes[/]")
 
     for episode in paging_list:
@@ -584,13 +1010,575 @@ def download_series(
                 compression=compression,
                 wait_interval=wait_interval,
                 overwrite = overwrite,
-                threads = threads
+                threads = threads,
+                store = store,
+                max_width = max_width,
+                max_height = max_height,
+                thumbnails = thumbnails,
+                rendition = rendition,
             )
             time.sleep(0.5)
         else:
             console.print(f"[yellow] Episode '{episode.title}' is not available for your account[/]")
 
+def resolve_series_id(series_id: str, allow_mismatch: bool = False) -> str | None:
+    """Series ID of an ID or URL, URLs of another site switch the global client with `allow_mismatch`"""
+    if len(series_id) == 13:
+        return series_id
+    if urlsplit(client.HOST).hostname in urlsplit(series_id).hostname:
+        return urlsplit(series_id).path.rstrip("/").split("/")[-1]
+    if urlsplit(client.HOST).hostname not in urlsplit(series_id).hostname:
+        if allow_mismatch:
+            client.HOST = normalizeHost(series_id)
+            console.print(f"[yellow]Hostname mismatch, using '{urlsplit(series_id).hostname}'[/]")
+            return urlsplit(series_id).path.rstrip("/").split("/")[-1]
+        console.print(f"[red]Invalid series ID: Hostname mismatch[/]")
+        typer.Abort()
+        return None
+    console.print("[red]Invalid series ID[/]")
+    typer.Abort()
+    return None
+
+def download_scheduled(
+        series_ids: list[str],
+        accessible: Callable[[MangaEpisodeItem], bool],
+        order: Policy,
+        preempt_within: float,
+        episode_concurrency: int,
+        options: dict,
+    ):
+    """Episodes of `series_ids` in the order of `order`, a series joins the queue as soon as its paging list is read"""
+    global event_loop
+    with_info = order in ("expiring", "smallest") or bool(preempt_within)
+
+    async def download_all():
+        scheduler = EpisodeScheduler(
+            order, episode_concurrency, preempt_within * 3600,
+            lambda job, urgent: console.print(f"[yellow] Pausing '{job.title}' for '{urgent.title}', its access ends {urgent.end_date}[/]"),
+        )
+        with Progress(console=console) as progress:
+            async def add_series(series_index: int, series_id: str):
+                try:
+                    paging_list = await asyncio.to_thread(list_series_episodes, series_id)
+                    jobs = await asyncio.to_thread(episode_jobs, client, series_index, paging_list, accessible, with_info)
+                except Exception as e:
+                    console.print(f"[red]Series '{series_id}': {e!r}[/]")
+                    return
+                console.print(f"[green]Series '{series_id}': {len(paging_list)} episodes, {len(jobs)} available[/]")
+                for job in jobs:
+                    scheduler.push(job)
+
+            async def download_one(job: EpisodeJob) -> bool:
+                done = await download_episode_async(episode_id=job.episode_id, progress=progress, **options)
+                if episode_concurrency == 1:
+                    await asyncio.sleep(0.5)
+                return bool(done)
+
+            producers = asyncio.gather(*[add_series(i, series_id) for i, series_id in enumerate(series_ids)])
+            results = await scheduler.run(download_one, producers)
+        for job, result in results:
+            if isinstance(result, BaseException):
+                console.print(f"[red] Episode '{job.title}' failed: {result!r}[/]")
+
+    event_loop = asyncio.get_event_loop()
+    event_loop.run_until_complete(download_all())
+
+@app.command("download-batch")
+def download_batch(
+    source: str = typer.Argument(help="File with one series / episode ID or URL per line, `-` reads stdin"),
+    kind: Literal["series", "episode"] = typer.Option("series", help="Type of bare 13 char IDs, URLs are detected by path"),
+    status: str = typer.Option("", help="Append the result of every item as a JSON line to this file"),
+    concurrency: int = typer.Option(2, min = 1, help="Episodes downloaded at the same time over all sites"),
+    rate: float = typer.Option(0, min = 0, help="Requests per second over all sites. 0: unlimited"),
+    cookies: str = "",
+    save_dir: str = "",
+    cbz: bool = typer.Option(False, help="Save as CBZ file"),
+    overwrite: bool = typer.Option(False, help="Overwrite existing files"),
+    wait_interval: float = typer.Option(0.5, min = 0, help="Wait interval between each page download"),
+    ls_webp: bool = typer.Option(False, help="Use lossless WebP instead of PNG"),
+    compression: int = typer.Option(1, min = 0, max = 9, help="Compression level, PNG max: 9, WebP max: 6"),
+    threads: int = typer.Option(1, min = 1, help="Download thread count per episode"),
+    store: str = typer.Option("", help="Content-addressed page store directory, reuses pages already downloaded from any site"),
+    max_width: int = typer.Option(0, min = 0, help="Scale pages down to this width, JPEG pages are decoded at reduced scale. 0: no limit"),
+    max_height: int = typer.Option(0, min = 0, help="Scale pages down to this height. 0: no limit"),
+    thumbnails: bool = typer.Option(False, help=f"Also save {THUMBNAIL_SIZE[0]}px JPEG thumbnails to `thumbnails/`, beside a CBZ to `<episode>.thumbnails/`"),
+    rendition: list[str] = typer.Option([], help="Output `<dir|cbz>:<png|webp>[:<compression>][:<W>x<H>][@<save_dir>]`, repeat for several outputs from one download, replaces `--cbz`/`--ls-webp`/`--compression`"),
+):
+    """
+    Download many series and episodes of any sites in one process
+
+    Lines are IDs or URLs, empty lines and lines starting with `#` are skipped.
+    Every site gets one client and connection pool, all items share `--concurrency` and `--rate`.
+    """
+    global event_loop
+    renditions = parse_renditions(rendition, save_dir)
+    client_init()
+    load_cookies(cookies)
+
+    lines = sys.stdin.read().splitlines() if source == "-" else pathlib.Path(source).read_text(encoding="utf-8").splitlines()
+    targets = [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+    budget = RateBudget(per_host=False)
+    clients: dict[str, ComiciClient] = {client.HOST: client}
+    if rate:
+        add_rate_limit(client, budget, rate)
+    status_file = open(status, "a", encoding="utf-8") if status else None
+
+    def new_client(host: str) -> Exception | None:
+        try:
+            clients[host] = host_client(host, cookies)
+        except Exception as e:
+            return e
+        if rate:
+            add_rate_limit(clients[host], budget, rate)
+
+    def report(target: str, result: dict):
+        if status_file:
+            status_file.write(json.dumps({"input": target, **result}, ensure_ascii=False) + "\n")
+            status_file.flush()
+        color = "green" if result["status"] == "done" else "red"
+        console.print(f"[{color}]{target}: {result['status']}{' ' + result['error'] if result.get('error') else ''}[/]")
+
+    async def download_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        with Progress(console=console) as progress:
+            async def download_one(episode_id: str, comici_client: ComiciClient) -> bool:
+                async with semaphore:
+                    return bool(await download_episode_async(
+                        episode_id=episode_id,
+                        save_dir=save_dir,
+                        cbz=cbz,
+                        ls_webp=ls_webp,
+                        compression=compression,
+                        wait_interval=wait_interval,
+                        overwrite=overwrite,
+                        threads=threads,
+                        store=store,
+                        max_width=max_width,
+                        max_height=max_height,
+                        thumbnails=thumbnails,
+                        renditions=renditions,
+                        progress=progress,
+                        comici_client=comici_client,
+                    ))
+
+            async def run_item(target: str, host: str, target_kind: str, target_id: str):
+                started = time.perf_counter()
+                result = {"host": host, "kind": target_kind, "id": target_id}
+                try:
+                    comici_client = clients[host]
+                    if target_kind == "episode":
+                        episode_ids = [target_id]
+                    else:
+                        async with semaphore:
+                            paging_list = await asyncio.to_thread(list_series_episodes, target_id, comici_client)
+                        episode_ids = [
+                            urlsplit(episode.href).path.rstrip("/").split("/")[-1] for episode in paging_list
+                            if episode.href and episode.symbols[0].split("\n")[0] in ACCESSABLE_SYMBOLS
+                        ]
+                        result["unavailable"] = len(paging_list) - len(episode_ids)
+                    done = await asyncio.gather(
+                        *[download_one(episode_id, comici_client) for episode_id in episode_ids], return_exceptions=True
+                    )
+                    errors = [e for e in done if isinstance(e, Exception)]
+                    result["episodes"] = len(episode_ids)
+                    result["failed"] = sum(1 for ok in done if ok is not True)
+                    result["status"] = "done" if not result["failed"] else "failed"
+                    if errors:
+                        result["error"] = repr(errors[0])
+                except Exception as e:
+                    result["status"] = "failed"
+                    result["error"] = repr(e)
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                report(target, result)
+
+            items = list()
+            for target in targets:
+                try:
+                    item = (target, *parseTarget(target, client.HOST, kind))
+                except ValueError as e:
+                    report(target, {"status": "invalid", "error": str(e)})
+                    continue
+                probe = lookup_site(client.CACHE_DIR_DEFAULT, item[1])
+                if probe is not None and not probe.reachable:
+                    report(target, {"status": "skipped", "host": item[1], "error": f"unreachable at the last `sites --probe`: {probe.error}"})
+                    continue
+                items.append(item)
+
+            hosts = list({item[1] for item in items if item[1] not in clients})
+            client_errors = dict(zip(hosts, await asyncio.gather(*[asyncio.to_thread(new_client, host) for host in hosts])))
+            for item in [item for item in items if client_errors.get(item[1])]:
+                report(item[0], {"status": "failed", "host": item[1], "kind": item[2], "id": item[3], "error": repr(client_errors[item[1]])})
+                items.remove(item)
+            await asyncio.gather(*[run_item(*item) for item in items])
+
+    console.print(f"[green]Downloading {len(targets)} items[/]")
+    event_loop = asyncio.get_event_loop()
+    try:
+        event_loop.run_until_complete(download_all())
+    finally:
+        if status_file:
+            status_file.close()
+
+@app.command()
+def serve(
+    port: int = typer.Option(8710, min = 1, help="Port of the local HTTP job API"),
+    bind: str = typer.Option("127.0.0.1", help="Address to listen on"),
+    jobs_path: str = typer.Option("jobs.sqlite3", "--jobs", help="SQLite file keeping the job list across restarts"),
+    concurrency: int = typer.Option(2, min = 1, help="Episodes downloaded at the same time over all jobs"),
+    cookies: str = "",
+    save_dir: str = typer.Option("", help="Default `save_dir` of jobs"),
+    cbz: bool = typer.Option(False, help="Default `cbz` of jobs"),
+    wait_interval: float = typer.Option(0.5, min = 0, help="Default `wait_interval` of jobs"),
+    ls_webp: bool = typer.Option(False, help="Default `ls_webp` of jobs"),
+    compression: int = typer.Option(1, min = 0, max = 9, help="Default `compression` of jobs"),
+    threads: int = typer.Option(1, min = 1, help="Default `threads` of jobs"),
+    store: str = typer.Option("", help="Default `store` of jobs"),
+):
+    """
+    Run one long-lived client that takes download jobs over a local HTTP/JSON API
+
+    `POST /jobs` with `{"target": "<ID or URL>", "kind": "series|episode", "action": "download|sync", "options": {...}}`,
+    `GET /jobs`, `GET /jobs/<id>` for status and progress, `DELETE /jobs/<id>` to cancel, `GET /health`.
+    Options are the `download-episode` options, e.g. `save_dir`, `cbz`, `ls_webp`, `page_from`.
+    """
+    global event_loop
+    client_init()
+    load_cookies(cookies)
+
+    jobs = ServerJobs(jobs_path)
+    clients: dict[str, ComiciClient] = {client.HOST: client}
+    running: dict[int, asyncio.Task] = dict()
+    event_loop = asyncio.get_event_loop()
+    wake = asyncio.Event()
+    episode_semaphore = asyncio.Semaphore(concurrency)
+    defaults = dict(
+        save_dir=save_dir,
+        cbz=cbz,
+        wait_interval=wait_interval,
+        ls_webp=ls_webp,
+        compression=compression,
+        threads=threads,
+        store=store,
+    )
+
+    def submit(body: dict) -> int:
+        action = body.get("action", "download")
+        if action not in ("download", "sync"):
+            raise ValueError(f"Unknown action: '{action}'")
+        _, kind, _ = parseTarget(body["target"], client.HOST, body.get("kind", "series"))
+        if action == "sync" and kind != "series":
+            raise ValueError("Only series can be synced")
+        options = body.get("options", dict())
+        unknown = set(options) - JOB_OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+        job_id = jobs.add(action, body["target"], kind, options)
+        event_loop.call_soon_threadsafe(wake.set)
+        return job_id
+
+    def cancel(job_id: int) -> bool:
+        job = jobs.get(job_id)
+        if not job or job["state"] not in ("queued", "running"):
+            return False
+        jobs.update(job_id, state="cancelled")
+        task = running.get(job_id)
+        if task:
+            event_loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def info() -> dict:
+        return {
+            "host": client.HOST,
+            "new_version": client.NEW_VERSION,
+            "user_id": client.user_id,
+            "hosts": list(clients),
+            "running": list(running),
+        }
+
+    async def run_job(job: dict):
+        progress = jobs.progress[job["id"]] = JobProgress()
+        jobs.update(job["id"], state="running", error=None, episodes_done=0)
+        try:
+            host, kind, target_id = parseTarget(job["target"], client.HOST, job["kind"])
+            if host not in clients:
+                clients[host] = await asyncio.to_thread(ComiciClient, host=host)
+            comici_client = clients[host]
+
+            if kind == "episode":
+                episode_ids = [target_id]
+            else:
+                paging_list = await asyncio.to_thread(list_series_episodes, target_id, comici_client)
+                episode_ids = [
+                    urlsplit(episode.href).path.rstrip("/").split("/")[-1] for episode in paging_list
+                    if episode.href and episode.symbols[0].split("\n")[0] in ACCESSABLE_SYMBOLS
+                ]
+            jobs.update(job["id"], episodes=len(episode_ids))
+
+            options = {**defaults, **job["options"]}
+            if job["action"] == "sync":
+                options["overwrite"] = False
+            episodes_done = 0
+
+            async def download_one(episode_id: str) -> bool:
+                nonlocal episodes_done
+                async with episode_semaphore:
+                    downloaded = bool(await download_episode_async(
+                        episode_id=episode_id,
+                        progress=progress,
+                        comici_client=comici_client,
+                        **options,
+                    ))
+                if downloaded:
+                    episodes_done += 1
+                    jobs.update(job["id"], episodes_done=episodes_done)
+                return downloaded
+
+            results = await asyncio.gather(*[download_one(episode_id) for episode_id in episode_ids])
+            if all(results):
+                jobs.update(job["id"], state="done")
+            else:
+                jobs.update(job["id"], state="failed", error=f"{results.count(False)} episodes not accessible")
+        except asyncio.CancelledError:
+            jobs.update(job["id"], state="cancelled")
+        except Exception as e:
+            jobs.update(job["id"], state="failed", error=repr(e))
+        finally:
+            running.pop(job["id"], None)
+
+    async def schedule():
+        while True:
+            for job in jobs.queued():
+                if job["id"] not in running:
+                    running[job["id"]] = asyncio.create_task(run_job(job))
+            wake.clear()
+            await wake.wait()
+
+    server = serve_jobs(jobs, submit, cancel, info, port, bind)
+    threading.Thread(target=server.serve_forever, name="job-server", daemon=True).start()
+    console.print(f"[green]Serving jobs on http://{bind}:{port}/jobs ({client.HOST})[/]")
+    try:
+        event_loop.run_until_complete(schedule())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        jobs.close()
+
+@app.command()
+def proxy(
+    port: int = typer.Option(8720, min = 1, help="Port of the page proxy"),
+    bind: str = typer.Option("127.0.0.1", help="Address to listen on"),
+    cookies: str = "",
+    prefetch: int = typer.Option(3, min = 0, help="Pages after the requested one fetched in the background"),
+    workers: int = typer.Option(4, min = 1, help="Background fetch threads"),
+    memory_cache: int = typer.Option(256, min = 0, help="MB of encoded pages kept in memory"),
+    disk_cache: int = typer.Option(2048, min = 0, help="MB of encoded pages kept in `<cache_dir>/pages`, 0: no disk cache"),
+    ls_webp: bool = typer.Option(False, help="Serve lossless WebP instead of PNG"),
+    compression: int = typer.Option(1, min = 0, max = 9, help="Compression level, PNG max: 9, WebP max: 6"),
+):
+    """
+    Serve descrambled pages over local HTTP without downloading whole episodes
+
+    `GET /episodes/<EPISODE_ID>/pages/<N>` returns page N (from 0), `GET /episodes/<EPISODE_ID>` the page count
+    """
+    client_init()
+    load_cookies(cookies)
+
+    cache = PageCache(
+        memory_cache * 1024 * 1024,
+        pathlib.Path(client.CACHE_DIR_DEFAULT) / "pages" if client.CACHE_DIR_DEFAULT else None,
+        disk_cache * 1024 * 1024,
+    )
+    page_proxy = PageProxy(client, cache, prefetch, workers, ls_webp, compression)
+    server = serve_proxy(page_proxy, port, bind)
+    console.print(f"[green]Serving pages of {client.HOST} on http://{bind}:{port}/episodes/<EPISODE_ID>/pages/<N>[/]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        page_proxy.close()
+
+@app.command("enqueue-series")
+def enqueue_series(
+    series_ids: list[str] = typer.Argument(help="Series IDs (13 chars) / full URLs of series, URLs of other sites are queued for that site"),
+    queue: str = typer.Option(..., help="SQLite job queue on a shared filesystem, or http://<coordinator>:<port>"),
+    cookies: str = "",
+):
+    """Expand series into episode jobs for `worker`"""
+    client_init()
+    load_cookies(cookies)
+    job_queue = open_queue(queue)
+
+    for target in series_ids:
+        try:
+            host, _, series_id = parseTarget(target, client.HOST)
+        except ValueError as e:
+            console.print(f"[red]{e}[/]")
+            continue
+        series_client = client if host == client.HOST else host_client(host, cookies)
+
+        added = skipped = 0
+        for episode in list_series_episodes(series_id, series_client):
+            if episode.href and episode.symbols[0].split("\n")[0] in ACCESSABLE_SYMBOLS:
+                if job_queue.add(host, series_id, urlsplit(episode.href).path.rstrip("/").split("/")[-1]):
+                    added += 1
+            else:
+                skipped += 1
+        console.print(f"[green]Queued {added} episodes of series '{series_id}' ({host}), {skipped} not available for your account[/]")
+
+    job_queue.close()
+
+@app.command("queue-status")
+def queue_status(
+    queue: str = typer.Argument(help="SQLite job queue on a shared filesystem, or http://<coordinator>:<port>"),
+):
+    """Count jobs of a queue by state"""
+    job_queue = open_queue(queue)
+    table = Table("State", "Jobs", title=f"Job Queue '{queue}'")
+    for state, count in sorted(job_queue.counts().items()):
+        table.add_row(state, str(count))
+    console.print(table)
+    job_queue.close()
+
+@app.command()
+def coordinator(
+    queue: str = typer.Argument(help="SQLite job queue file"),
+    port: int = typer.Option(8700, min = 1, help="Port of the HTTP job API"),
+    bind: str = typer.Option("127.0.0.1", help="Address to listen on, 0.0.0.0 accepts workers of other machines"),
+    max_attempts: int = typer.Option(3, min = 1, help="Leases of a job before it is marked failed"),
+):
+    """Serve a job queue over HTTP, for workers without a shared filesystem"""
+    server = serve_coordinator(JobQueue(queue, max_attempts), port, bind)
+    console.print(f"[green]Coordinating '{queue}' on http://{bind}:{port}[/]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def rate_limit_hooks(budget: JobQueue | RemoteJobQueue | RateBudget, rate: float) -> tuple[Callable, Callable]:
+    """httpx request hooks waiting for a request slot of a job queue or an in-process `RateBudget`"""
+    def wait(request: httpx.Request):
+        time.sleep(budget.acquire_rate(request.url.host, rate))
+
+    async def wait_async(request: httpx.Request):
+        await asyncio.sleep(await asyncio.to_thread(budget.acquire_rate, request.url.host, rate))
+
+    return wait, wait_async
+
+def add_rate_limit(comici_client: ComiciClient, budget: JobQueue | RemoteJobQueue | RateBudget, rate: float):
+    wait, wait_async = rate_limit_hooks(budget, rate)
+    comici_client.main_client.event_hooks["request"].append(wait)
+    comici_client.cdn_client.event_hooks["request"].append(wait)
+    comici_client.async_cdn_client.event_hooks["request"].append(wait_async)
+
+@app.command()
+def worker(
+    queue: str = typer.Argument(help="SQLite job queue on a shared filesystem, or http://<coordinator>:<port>"),
+    worker_id: str = typer.Option("", help="Name of this worker in the queue, default: <hostname>-<pid>"),
+    rate: float = typer.Option(0, min = 0, help="Requests per second per host, shared by every worker of the queue. 0: unlimited"),
+    lease: float = typer.Option(60, min = 3, help="Seconds a job is leased for, renewed every third of it"),
+    poll_interval: float = typer.Option(5, min = 0.1, help="Seconds to wait when the queue is empty"),
+    exit_when_empty: bool = typer.Option(False, help="Exit when there is no job left instead of waiting for more"),
+    cookies: str = "",
+    save_dir: str = "",
+    cbz: bool = typer.Option(False, help="Save as CBZ file"),
+    overwrite: bool = typer.Option(False, help="Overwrite existing files"),
+    wait_interval: float = typer.Option(0.5, min = 0, help="Wait interval between each page download"),
+    ls_webp: bool = typer.Option(False, help="Use lossless WebP instead of PNG"),
+    compression: int = typer.Option(1, min = 0, max = 9, help="Compression level, PNG max: 9, WebP max: 6"),
+    threads: int = typer.Option(1, min = 1, help="Download thread count"),
+    store: str = typer.Option("", help="Content-addressed page store directory, reuses pages already downloaded from any site"),
+    max_width: int = typer.Option(0, min = 0, help="Scale pages down to this width, JPEG pages are decoded at reduced scale. 0: no limit"),
+    max_height: int = typer.Option(0, min = 0, help="Scale pages down to this height. 0: no limit"),
+    thumbnails: bool = typer.Option(False, help=f"Also save {THUMBNAIL_SIZE[0]}px JPEG thumbnails to `thumbnails/`, beside a CBZ to `<episode>.thumbnails/`"),
+    rendition: list[str] = typer.Option([], help="Output `<dir|cbz>:<png|webp>[:<compression>][:<W>x<H>][@<save_dir>]`, repeat for several outputs from one download, replaces `--cbz`/`--ls-webp`/`--compression`"),
+):
+    """
+    Download episode jobs queued by `enqueue-series`
+
+    Run any number of workers on any number of machines against the same queue
+    """
+    global event_loop
+    renditions = parse_renditions(rendition, save_dir)
+    worker_id = worker_id if worker_id else f"{socket.gethostname()}-{os.getpid()}"
+    job_queue = open_queue(queue)
+    clients: dict[str, ComiciClient] = dict()
+
+    def client_for(host: str) -> ComiciClient:
+        if host not in clients:
+            clients[host] = host_client(host, cookies)
+            if rate:
+                add_rate_limit(clients[host], job_queue, rate)
+        return clients[host]
+
+    async def run_job(job) -> bool:
+        job_client = await asyncio.to_thread(client_for, job.host)
+        download = asyncio.create_task(download_episode_async(
+            episode_id=job.episode_id,
+            # `client_for` already gave the job client its cookies, the global client is of no use here
+            cookies="",
+            page_from=job.page_from,
+            page_to=job.page_to,
+            save_dir=save_dir,
+            cbz=cbz,
+            overwrite=overwrite,
+            wait_interval=wait_interval,
+            ls_webp=ls_webp,
+            compression=compression,
+            threads=threads,
+            store=store,
+            max_width=max_width,
+            max_height=max_height,
+            thumbnails=thumbnails,
+            renditions=renditions,
+            comici_client=job_client,
+        ))
+        while True:
+            done, _ = await asyncio.wait({download}, timeout=lease / 3)
+            if done:
+                return bool(download.result())
+            if not await asyncio.to_thread(job_queue.heartbeat, job._id, worker_id, lease):
+                download.cancel()
+                # let it close its writers before the next job, another worker may write the same output
+                await asyncio.gather(download, return_exceptions=True)
+                raise RuntimeError(f"Lease of job {job._id} lost")
+
+    async def work():
+        while True:
+            job = await asyncio.to_thread(job_queue.lease, worker_id, lease)
+            if not job:
+                if exit_when_empty:
+                    break
+                await asyncio.sleep(poll_interval)
+                continue
+
+            console.print(f"[green]Job {job._id}: episode '{job.episode_id}' of '{job.host}' (attempt {job.attempts})[/]")
+            try:
+                if await run_job(job):
+                    await asyncio.to_thread(job_queue.complete, job._id, worker_id)
+                else:
+                    await asyncio.to_thread(job_queue.fail, job._id, worker_id, "Episode not accessible")
+            except Exception as e:
+                console.print(f"[red]Job {job._id} failed: {e!r}[/]")
+                await asyncio.to_thread(job_queue.fail, job._id, worker_id, repr(e))
+
+    console.print(f"[green]Worker '{worker_id}' polling '{queue}'[/]")
+    event_loop = asyncio.get_event_loop()
+    try:
+        event_loop.run_until_complete(work())
+    finally:
+        job_queue.close()
+
 if __name__ == "__main__":
-    app()
+    try:
+        app()
+    except archive.ReplayMissError as e:
+        err_console.print(f"[red]{e}, the archive was recorded with other commands or options[/]")
+        sys.exit(1)
     if event_loop:
         event_loop.close()
\ No newline at end of file
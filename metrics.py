@@ -0,0 +1,253 @@
+import json, os, pathlib, re, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+class Metric:
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.registry: "Registry | None" = None
+        self._values: dict[tuple[str, ...], object] = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.registry is None or self.registry.enabled
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple[str, ...], extra: dict | None = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def exposition(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [{"labels": dict(zip(self.labelnames, key)), "value": value} for key, value in self._values.items()]
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.active:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        if not self.active:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.active:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        if not self.active:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def exposition(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state["buckets"]):
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': bound})} {count}")
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': '+Inf'})} {state['count']}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {state['sum']}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {state['count']}")
+        return lines
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return [
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "buckets": dict(zip(map(str, self.buckets), state["buckets"])),
+                    "sum": state["sum"],
+                    "count": state["count"],
+                }
+                for key, state in self._values.items()
+            ]
+
+class Registry:
+    """
+    Process wide counters, gauges and histograms
+
+    Instrumentation always calls into the registry, nothing is recorded until
+    `enabled` is set by `--metrics-port` or `--metrics-snapshot`.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.metrics: list[Metric] = list()
+        self.started = time.time()
+
+    def register(self, metric: Metric) -> Metric:
+        metric.registry = self
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = Histogram.BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def exposition(self) -> str:
+        lines = list()
+        for metric in self.metrics:
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {
+            "timestamp": time.time(),
+            "uptime": time.time() - self.started,
+            "metrics": {metric.name: {"type": metric.TYPE, "values": metric.snapshot()} for metric in self.metrics},
+        }
+
+    def write_snapshot(self, path: str | pathlib.Path):
+        path = pathlib.Path(path)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """`/metrics` in Prometheus text format, `/metrics.json` as the JSON snapshot"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, content_type = registry.exposition().encode(), "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+    def snapshot_periodically(self, path: str | pathlib.Path, interval: float = 10.0) -> threading.Event:
+        """Write the JSON snapshot every `interval` seconds until the returned event is set"""
+        stop = threading.Event()
+        def run():
+            while not stop.wait(interval):
+                self.write_snapshot(path)
+        threading.Thread(target=run, name="metrics-snapshot", daemon=True).start()
+        return stop
+
+registry = Registry()
+
+REQUESTS = registry.counter("comici_http_requests_total", "HTTP requests by client, host, endpoint and status", ("client", "host", "endpoint", "status"))
+REQUEST_SECONDS = registry.histogram("comici_http_request_seconds", "HTTP request latency", ("client", "host", "endpoint"))
+REQUEST_ERRORS = registry.counter("comici_http_errors_total", "HTTP requests failed without a response", ("client", "host", "error"))
+RETRIES = registry.counter("comici_retries_total", "Requests repeated by the downloader", ("reason",))
+BYTES_DOWNLOADED = registry.counter("comici_bytes_downloaded_total", "Response body bytes", ("client", "host"))
+PAGES = registry.counter("comici_pages_total", "Pages handled by the downloader", ("result",))
+STAGE_SECONDS = registry.histogram("comici_stage_seconds", "Latency of download stages such as descramble and encode", ("stage",))
+QUEUE_DEPTH = registry.gauge("comici_page_queue_depth", "Page tasks scheduled but not finished")
+WRITE_QUEUE_DEPTH = registry.gauge("comici_write_queue_depth", "Page writes queued or running on the writer pool")
+CDN_IN_FLIGHT = registry.gauge("comici_cdn_in_flight", "CDN requests holding a download semaphore slot")
+
+ID_SEGMENT = re.compile(r"^(?=.*\d)[0-9A-Za-z_-]{8,}$")
+
+def endpoint_of(url) -> str:
+    """URL path with ID-like segments folded, so label cardinality stays bounded"""
+    path = urlsplit(str(url)).path
+    return "/".join("{id}" if ID_SEGMENT.match(segment) else segment for segment in path.split("/")) or "/"
+
+def httpx_hooks(client_name: str, endpoint: str | None = None, is_async: bool = False) -> dict:
+    """httpx `event_hooks` recording request counts, latency, status codes and bytes"""
+    def on_request(request):
+        if registry.enabled:
+            request.extensions["metrics_started"] = time.perf_counter()
+
+    def record(response):
+        request = response.request
+        host = request.url.host
+        label = endpoint if endpoint else endpoint_of(request.url)
+        REQUESTS.inc(client=client_name, host=host, endpoint=label, status=response.status_code)
+        started = request.extensions.get("metrics_started")
+        if started is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, client=client_name, host=host, endpoint=label)
+        BYTES_DOWNLOADED.inc(len(response.content), client=client_name, host=host)
+
+    if is_async:
+        async def on_request_async(request):
+            on_request(request)
+
+        async def on_response_async(response):
+            if registry.enabled:
+                await response.aread()
+                record(response)
+
+        return {"request": [on_request_async], "response": [on_response_async]}
+
+    def on_response(response):
+        if registry.enabled:
+            response.read()
+            record(response)
+
+    return {"request": [on_request], "response": [on_response]}
+
+def observe_span(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
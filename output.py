@@ -0,0 +1,43 @@
+import csv, datetime, json, sys
+from typing import Literal, TextIO
+
+OutputFormat = Literal["table", "jsonl", "csv", "tsv"]
+
+class RowWriter:
+    """
+    Writes listing rows to stdout as soon as they are known, instead of a `rich` table
+
+    JSONL keeps lists as arrays, CSV/TSV join them with `;`. The header is written
+    before the first row, every row is flushed so pipes see it immediately.
+    """
+    def __init__(self, output: OutputFormat, fields: list[str], stream: TextIO | None = None):
+        self.output = output
+        self.fields = fields
+        self.stream = stream if stream else sys.stdout
+        self.rows = 0
+        self._csv = None
+        if output in ("csv", "tsv"):
+            self._csv = csv.writer(self.stream, delimiter="," if output == "csv" else "\t", lineterminator="\n")
+
+    @staticmethod
+    def _value(value, flat: bool):
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        if flat and isinstance(value, (list, tuple)):
+            return ";".join(str(v) for v in value)
+        if flat and value is None:
+            return ""
+        return value
+
+    def write(self, **values):
+        if self._csv:
+            if not self.rows:
+                self._csv.writerow(self.fields)
+            self._csv.writerow([self._value(values.get(field), True) for field in self.fields])
+        else:
+            self.stream.write(json.dumps(
+                {field: self._value(values.get(field), False) for field in self.fields},
+                ensure_ascii=False
+            ) + "\n")
+        self.stream.flush()
+        self.rows += 1
@@ -0,0 +1,77 @@
+"""
+Output stages for `ComiciClient.iter_episode_pages()` and `aiter_pages()`
+
+Every stage takes and yields `(ContentsInfo, value)` pairs, so they chain:
+
+    pages = client.iter_episode_pages(episode_id, concurrency=4)
+    for contents, path in pipeline.save(pipeline.encode(pages, ls_webp=True), "out"):
+        ...
+"""
+import asyncio, pathlib, zipfile
+from typing import Iterable, Iterator, AsyncIterable, AsyncIterator
+from PIL import Image
+from structs import ContentsInfo
+from utils import encodeImage
+
+def page_filename(contents: ContentsInfo, ls_webp: bool = False, digits: int = 3) -> str:
+    """Same names as `download-episode`, `001.png` for the first page"""
+    return "{}.{}".format(str(contents.sort + 1).rjust(digits, "0"), "webp" if ls_webp else "png")
+
+def encode(
+        pages: Iterable[tuple[ContentsInfo, Image.Image]],
+        ls_webp: bool = False,
+        compression: int = 1,
+    ) -> Iterator[tuple[ContentsInfo, bytes]]:
+    for contents, image in pages:
+        data = encodeImage(image, ls_webp, compression)
+        image.close()
+        yield contents, data
+
+def save(
+        pages: Iterable[tuple[ContentsInfo, bytes]],
+        save_dir: str | pathlib.Path,
+        ls_webp: bool = False,
+        digits: int = 3,
+    ) -> Iterator[tuple[ContentsInfo, pathlib.Path]]:
+    save_dir = pathlib.Path(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    for contents, data in pages:
+        path = save_dir / page_filename(contents, ls_webp, digits)
+        path.write_bytes(data)
+        yield contents, path
+
+def write_cbz(
+        pages: Iterable[tuple[ContentsInfo, bytes]],
+        cbz_path: str | pathlib.Path,
+        ls_webp: bool = False,
+        digits: int = 3,
+    ) -> Iterator[tuple[ContentsInfo, str]]:
+    with zipfile.ZipFile(cbz_path, "w") as cbz_file:
+        for contents, data in pages:
+            filename = page_filename(contents, ls_webp, digits)
+            cbz_file.writestr(filename, data)
+            yield contents, filename
+
+async def aencode(
+        pages: AsyncIterable[tuple[ContentsInfo, Image.Image]],
+        ls_webp: bool = False,
+        compression: int = 1,
+    ) -> AsyncIterator[tuple[ContentsInfo, bytes]]:
+    """Encodes on a worker thread, the event loop keeps fetching meanwhile"""
+    async for contents, image in pages:
+        data = await asyncio.to_thread(encodeImage, image, ls_webp, compression)
+        image.close()
+        yield contents, data
+
+async def asave(
+        pages: AsyncIterable[tuple[ContentsInfo, bytes]],
+        save_dir: str | pathlib.Path,
+        ls_webp: bool = False,
+        digits: int = 3,
+    ) -> AsyncIterator[tuple[ContentsInfo, pathlib.Path]]:
+    save_dir = pathlib.Path(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    async for contents, data in pages:
+        path = save_dir / page_filename(contents, ls_webp, digits)
+        await asyncio.to_thread(path.write_bytes, data)
+        yield contents, path
@@ -0,0 +1,181 @@
+"""
+Estimates for `download-series --plan`
+
+Only metadata is requested: the paging list, one `book_contentsInfo` per
+episode for its page count, and ranged requests of the first bytes of a few
+sampled pages for their size and the CDN throughput. Pages already in the
+outputs the download writes to, found by their `.pages.json` manifests, are not
+counted again; with several renditions the one with the fewest pages counts.
+"""
+import collections, concurrent.futures, json, pathlib, shutil, statistics, time, zipfile
+from client import ComiciClient
+from integrity import MANIFEST_NAME
+from structs import EpisodePlan, Rendition
+
+SAMPLE_BYTES = 64 * 1024
+PLAN_WORKERS = 8
+# requests of `prepare_episode` besides the pages: episode page, episode/book info, contentsInfo
+API_REQUESTS_PER_EPISODE = {False: 4, True: 5}
+# lossless output per pixel of a descrambled page, used when no manifest of the encoding exists
+BYTES_PER_PIXEL = {"png": 1.2, "webp": 0.8}
+# `download-series` sleeps between episodes when they are not downloaded concurrently
+EPISODE_PAUSE = 0.5
+
+def scan_manifests(renditions: list[Rendition]) -> tuple[dict[tuple[str, str, int], pathlib.Path], dict[str, list[int]]]:
+    """
+    Outputs by `(host, episode_id, rendition index)`, and encoded page sizes by encoding
+
+    Only the places the download writes to are looked at: `<save_dir>/<title>/<episode>/`
+    for page directories and `<save_dir>/<title>/<episode>.cbz` for CBZ files.
+    """
+    outputs: dict[tuple[str, str, int], pathlib.Path] = dict()
+    sizes: dict[str, list[int]] = collections.defaultdict(list)
+    for index, rendition in enumerate(renditions):
+        save_dir = pathlib.Path(rendition.save_dir or ".")
+        if not save_dir.exists():
+            continue
+        # pages of an interrupted CBZ download left in the directory are moved into the CBZ
+        patterns = [f"*/.*.cbz{MANIFEST_NAME}", f"*/*/{MANIFEST_NAME}"] if rendition.kind == "cbz" else [f"*/*/{MANIFEST_NAME}"]
+        for path in (path for pattern in patterns for path in save_dir.glob(pattern)):
+            target = path.parent if path.name == MANIFEST_NAME else path.with_name(path.name[1:-len(MANIFEST_NAME)])
+            try:
+                manifest = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if not target.exists() or "host" not in manifest:
+                continue
+            outputs.setdefault((manifest["host"], manifest["episode_id"], index), target)
+            sizes[manifest.get("encoding", "")].extend(entry["size"] for entry in manifest.get("pages", dict()).values())
+    return outputs, sizes
+
+def count_present(target: pathlib.Path, rendition: Rendition, pages: int) -> int:
+    """Pages of `target` the download skips, the file names it writes for `pages` pages"""
+    digits = len(str(pages)) + 1
+    names = {"{}.{}".format(str(sort + 1).rjust(digits, "0"), "webp" if rendition.ls_webp else "png") for sort in range(pages)}
+    if target.suffix == ".cbz":
+        try:
+            with zipfile.ZipFile(target) as cbz_file:
+                in_cbz = names & set(cbz_file.namelist())
+        except (OSError, zipfile.BadZipFile):
+            in_cbz = set()
+        directory = target.with_suffix("")
+        return len(in_cbz | {name for name in names - in_cbz if (directory / name).exists()})
+    return sum(1 for name in names if (target / name).exists())
+
+def sample_page(comici_client: ComiciClient, image_url: str, headers: dict[str, str]) -> tuple[int | None, float, float]:
+    """`(page bytes, seconds to the first byte, bytes per second)` from the first `SAMPLE_BYTES` of a page"""
+    started = time.perf_counter()
+    with comici_client.cdn_client.stream("GET", image_url, headers={**headers, "Range": f"bytes=0-{SAMPLE_BYTES - 1}"}) as response:
+        response.raise_for_status()
+        first_byte = time.perf_counter()
+        if response.status_code == 206 and "/" in response.headers.get("Content-Range", ""):
+            size = response.headers["Content-Range"].rsplit("/", 1)[1]
+        else:
+            size = response.headers.get("Content-Length")
+        received = 0
+        for chunk in response.iter_bytes():
+            received += len(chunk)
+            if received >= SAMPLE_BYTES:
+                break
+    finished = time.perf_counter()
+    return (
+        int(size) if size and size.isdigit() else None,
+        first_byte - started,
+        received / (finished - first_byte) if finished > first_byte and received else 0.0
+    )
+
+def plan_series(
+        comici_client: ComiciClient,
+        episodes: list[tuple[str, str]],
+        renditions: list[Rendition],
+        sample: int = 5,
+        threads: int = 1,
+        episode_concurrency: int = 1,
+        unavailable: int = 0,
+    ) -> dict:
+    """Report of downloading `episodes`, `(episode_id, title)` pairs of the accessible episodes"""
+    outputs, sizes = scan_manifests(renditions)
+    api_seconds: list[float] = list()
+    managers = dict()
+
+    def count_pages(episode_id: str, title: str) -> EpisodePlan:
+        started = time.perf_counter()
+        try:
+            managers[episode_id] = manager = comici_client.contents_manager(episode_id)
+        except PermissionError:
+            return EpisodePlan(episode_id, title, 0, 0)
+        pages = manager.page_count()
+        if not pages and not comici_client.NEW_VERSION:
+            # old sites may leave out totalPages, their episode info has it
+            pages = next((
+                int(info.page_count) for info in comici_client.book_episodeInfo(manager.comici_viewer_id)
+                if info._id == manager.comici_viewer_id and str(info.page_count).isdigit()
+            ), 0)
+        # the episode page and one book_contentsInfo
+        api_seconds.append((time.perf_counter() - started) / 2)
+        present = min(
+            count_present(target, rendition, pages) if (target := outputs.get((comici_client.HOST, episode_id, index))) else 0
+            for index, rendition in enumerate(renditions)
+        )
+        return EpisodePlan(episode_id, title, pages, min(present, pages))
+
+    with concurrent.futures.ThreadPoolExecutor(PLAN_WORKERS) as executor:
+        plans = list(executor.map(lambda episode: count_pages(*episode), episodes))
+
+    samples = list()
+    candidates = [plan for plan in plans if plan.pages]
+    for i in range(min(sample, sum(plan.pages for plan in candidates))):
+        plan = candidates[i * len(candidates) // sample % len(candidates)]
+        contents = managers[plan.episode_id].get(i % plan.pages, i % plan.pages)[0]
+        context = comici_client.request_context(plan.episode_id)
+        samples.append((contents.width * contents.height, *sample_page(comici_client, contents.imageUrl, context.headers)))
+
+    sized = [s for s in samples if s[1]]
+    page_bytes = statistics.mean(s[1] for s in sized) if sized else None
+    page_pixels = statistics.mean(s[0] for s in samples) if samples else None
+    latency = statistics.median(s[2] for s in samples) if samples else None
+    throughput = statistics.median(s[3] for s in samples if s[3]) if any(s[3] for s in samples) else None
+
+    pages = sum(plan.pages for plan in plans)
+    missing = sum(max(plan.pages - plan.present, 0) for plan in plans)
+    api_requests = len(plans) * API_REQUESTS_PER_EPISODE[comici_client.NEW_VERSION]
+
+    disk = dict()
+    for output in BYTES_PER_PIXEL:
+        measured = [size for encoding, encoding_sizes in sizes.items() if encoding.startswith(output) for size in encoding_sizes]
+        per_page = statistics.mean(measured) if measured else page_pixels * BYTES_PER_PIXEL[output] if page_pixels else None
+        disk[output] = round(per_page * missing) if per_page is not None else None
+
+    seconds = None
+    if latency is not None:
+        page_seconds = latency + (page_bytes / throughput if page_bytes and throughput else 0)
+        seconds = (
+            missing * page_seconds / (threads * episode_concurrency)
+            + api_requests * statistics.mean(api_seconds or [latency]) / episode_concurrency
+            + (EPISODE_PAUSE * len(plans) if episode_concurrency == 1 else 0)
+        )
+
+    existing = pathlib.Path(renditions[0].save_dir or ".").resolve()
+    while not existing.exists():
+        existing = existing.parent
+    free = shutil.disk_usage(existing).free
+    return {
+        "host": comici_client.HOST,
+        "episodes": len(plans),
+        "unavailable": unavailable,
+        "pages": pages,
+        "pages_present": pages - missing,
+        "pages_to_fetch": missing,
+        "requests": {"api": api_requests, "cdn": missing, "total": api_requests + missing},
+        "sampled_pages": len(samples),
+        "page_bytes": round(page_bytes) if page_bytes else None,
+        "transfer_bytes": round(page_bytes * missing) if page_bytes else None,
+        "disk_bytes": disk,
+        "free_disk_bytes": free,
+        "fits_on_disk": {output: size <= free for output, size in disk.items() if size is not None},
+        "estimated_seconds": round(seconds, 1) if seconds is not None else None,
+        "episode_plans": [
+            {"episode_id": plan.episode_id, "title": plan.title, "pages": plan.pages, "present": plan.present}
+            for plan in plans
+        ],
+    }
@@ -0,0 +1,114 @@
+import cProfile, pstats, pathlib, sys, threading, time
+from typing import Literal
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent
+
+def module_name(filename: str) -> str:
+    """`client` for modules of this project, `<package>.<module>` for everything else"""
+    path = pathlib.Path(filename)
+    if path.parent == PROJECT_ROOT:
+        return path.stem
+    return f"{path.parent.name}.{path.stem}" if path.parent.name else path.stem
+
+def module_matches(filename: str, modules: set[str]) -> bool:
+    """Project modules match by name, third-party code matches by package name"""
+    path = pathlib.Path(filename)
+    if path.parent == PROJECT_ROOT:
+        return path.stem in modules
+    return any(part in modules for part in path.parts[:-1])
+
+class StackSampler:
+    """Samples the Python stacks of every thread, for flamegraph tools"""
+    def __init__(self, interval: float = 0.005, modules: set[str] | None = None):
+        self.interval = interval
+        self.modules = modules
+        self.counts: dict[str, int] = dict()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _keep(self, filename: str) -> bool:
+        return not self.modules or module_matches(filename, self.modules)
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = list()
+                while frame:
+                    code = frame.f_code
+                    if self._keep(code.co_filename):
+                        stack.append(f"{module_name(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def dump(self, path: str | pathlib.Path):
+        """Collapsed stack format, `flamegraph.pl` / speedscope / inferno compatible"""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+class Profiler:
+    """
+    Wraps a command in cProfile and/or the stack sampler
+
+    `deterministic` runs cProfile on the main thread and the sampler on every thread,
+    `sampling` only runs the sampler and does not write a pstats file.
+    """
+    def __init__(
+            self,
+            prefix: str,
+            mode: Literal["deterministic", "sampling"] = "deterministic",
+            modules: set[str] | None = None,
+            interval: float = 0.005,
+        ):
+        self.prefix = prefix
+        self.mode = mode
+        self.modules = modules
+        self.sampler = StackSampler(interval, modules)
+        self.profile = cProfile.Profile() if mode == "deterministic" else None
+        self.started = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        if self.profile:
+            self.profile.enable()
+
+    def stop(self) -> list[pathlib.Path]:
+        if self.profile:
+            self.profile.disable()
+        self.sampler.stop()
+
+        written = list()
+        if self.profile:
+            stats = pstats.Stats(self.profile)
+            if self.modules:
+                keep = lambda func: module_matches(func[0], self.modules)
+                stats.stats = {
+                    func: (cc, nc, tt, ct, {caller: v for caller, v in callers.items() if keep(caller)})
+                    for func, (cc, nc, tt, ct, callers) in stats.stats.items() if keep(func)
+                }
+            pstats_path = pathlib.Path(f"{self.prefix}.pstats")
+            stats.dump_stats(pstats_path)
+            written.append(pstats_path)
+
+        collapsed_path = pathlib.Path(f"{self.prefix}.collapsed.txt")
+        self.sampler.dump(collapsed_path)
+        written.append(collapsed_path)
+        return written
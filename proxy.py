@@ -0,0 +1,225 @@
+import collections, concurrent.futures, json, os, pathlib, re, threading, httpx
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from contents import ContentsInfoManager
+from integrity import PageIntegrityError
+from store import PageStore
+from utils import encodeImage
+
+class PageCache:
+    """
+    Size-bounded LRU of encoded pages
+
+    Pages live in memory up to `memory_bytes`, and on disk up to `disk_bytes`
+    when `disk_dir` is given, so a restarted proxy does not fetch them again.
+    """
+    def __init__(self, memory_bytes: int, disk_dir: str | pathlib.Path | None = None, disk_bytes: int = 0):
+        self.memory_bytes = memory_bytes
+        self.memory: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+        self.memory_used = 0
+
+        self.disk_dir = pathlib.Path(disk_dir) if disk_dir and disk_bytes else None
+        self.disk_bytes = disk_bytes
+        self.disk: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self.disk_used = 0
+        self._lock = threading.Lock()
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            for path in sorted(self.disk_dir.iterdir(), key=lambda p: p.stat().st_mtime):
+                if path.suffix == ".tmp":
+                    path.unlink(missing_ok=True)
+                    continue
+                self.disk[path.name] = path.stat().st_size
+                self.disk_used += self.disk[path.name]
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+        try:
+            data = (self.disk_dir / key).read_bytes()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        self._remember(key, data)
+        if not self.disk_dir or len(data) > self.disk_bytes:
+            return
+        tmp_path = self.disk_dir / f".{key}.{threading.get_ident()}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.disk_dir / key)
+        with self._lock:
+            self.disk_used += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            while self.disk_used > self.disk_bytes:
+                old_key, size = self.disk.popitem(last=False)
+                self.disk_used -= size
+                (self.disk_dir / old_key).unlink(missing_ok=True)
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self.memory.pop(key, None)
+            self.memory_used += len(data) - (len(old) if old is not None else 0)
+            self.memory[key] = data
+            while self.memory_used > self.memory_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_used -= len(evicted)
+
+class PageProxy:
+    """
+    Descrambled pages on demand
+
+    Signed URLs are resolved lazily through `ContentsInfoManager` for the
+    requested page and the `prefetch` pages after it, which are then fetched in
+    the background so that a reader turning pages hits the cache.
+    """
+    def __init__(self, client, cache: PageCache, prefetch: int = 3, workers: int = 4, ls_webp: bool = False, compression: int = 1):
+        self.client = client
+        self.cache = cache
+        self.prefetch = prefetch
+        self.ls_webp = ls_webp
+        self.compression = compression
+        self.encoding = PageStore.encoding_key(ls_webp, compression)
+        self.content_type = "image/webp" if ls_webp else "image/png"
+
+        self.episodes: dict[str, ContentsInfoManager] = dict()
+        self.loading: dict[str, concurrent.futures.Future] = dict()
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="proxy")
+        self._lock = threading.Lock()
+
+    def contents_manager(self, episode_id: str) -> ContentsInfoManager:
+        with self._lock:
+            manager = self.episodes.get(episode_id)
+        if manager:
+            return manager
+        manager = self.client.contents_manager(episode_id)
+        with self._lock:
+            return self.episodes.setdefault(episode_id, manager)
+
+    def page_count(self, episode_id: str) -> int:
+        return self.contents_manager(episode_id).page_count()
+
+    def key(self, episode_id: str, page: int) -> str:
+        """Cache key of a page, pages of another encoding (`png-1`, `webp-6`) are never served for this one"""
+        return "{}_{}_{}_{}.{}".format(
+            urlsplit(self.client.HOST).netloc.replace(":", "_"), episode_id, page, self.encoding, "webp" if self.ls_webp else "png"
+        )
+
+    def page(self, episode_id: str, page: int) -> bytes:
+        manager = self.contents_manager(episode_id)
+        page_count = manager.page_count()
+        if page < 0 or page >= page_count:
+            raise IndexError(f"Page {page} out of range, episode has {page_count} pages")
+
+        data = self.cache.get(self.key(episode_id, page))
+        ahead = [
+            n for n in range(page + 1, min(page + self.prefetch, page_count - 1) + 1)
+            if self.cache.get(self.key(episode_id, n)) is None
+        ]
+        missing = ([page] if data is None else []) + ahead
+        if missing:
+            # one book_contentsInfo call signs the whole read-ahead window
+            manager.get(missing[0], missing[-1])
+        for n in ahead:
+            self._load(episode_id, n)
+        if data is not None:
+            return data
+        # the requested page is fetched on this thread, never queued behind read-ahead
+        return self._load(episode_id, page, inline=True).result()
+
+    def _load(self, episode_id: str, page: int, inline: bool = False) -> concurrent.futures.Future:
+        key = self.key(episode_id, page)
+        with self._lock:
+            future = self.loading.get(key)
+            if future:
+                return future
+            if inline:
+                future = self.loading[key] = concurrent.futures.Future()
+            else:
+                future = self.loading[key] = self.executor.submit(self._fetch, episode_id, page)
+        future.add_done_callback(lambda _: self._forget(key))
+        if inline:
+            try:
+                future.set_result(self._fetch(episode_id, page))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def _forget(self, key: str):
+        with self._lock:
+            self.loading.pop(key, None)
+
+    def _fetch(self, episode_id: str, page: int) -> bytes:
+        manager = self.contents_manager(episode_id)
+        contents = manager.get(page, page)[0]
+        context = self.client.request_context(episode_id)
+        try:
+            image = self.client.get_and_descramble_image(contents, context)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in (401, 403, 410):
+                raise
+            contents = manager.refresh(page, page)[0]
+            image = self.client.get_and_descramble_image(contents, context)
+        data = encodeImage(image, self.ls_webp, self.compression)
+        image.close()
+        self.cache.put(self.key(episode_id, page), data)
+        return data
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+EPISODE_PATH = re.compile(r"^/episodes/([0-9A-Za-z_-]+)/?$")
+PAGE_PATH = re.compile(r"^/episodes/([0-9A-Za-z_-]+)/pages/(\d+)/?$")
+
+def serve_proxy(proxy: PageProxy, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """`GET /episodes/<id>` for the page count, `GET /episodes/<id>/pages/<n>` for page `n` (from 0)"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status: int, body: bytes, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 200 and content_type.startswith("image/"):
+                self.send_header("Cache-Control", "private, max-age=86400")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def error(self, status: int, message: str):
+            self.reply(status, json.dumps({"error": message}).encode())
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            try:
+                if match := PAGE_PATH.match(path):
+                    self.reply(200, proxy.page(match.group(1), int(match.group(2))), proxy.content_type)
+                elif match := EPISODE_PATH.match(path):
+                    episode_id = match.group(1)
+                    self.reply(200, json.dumps({"episode_id": episode_id, "pages": proxy.page_count(episode_id)}).encode())
+                else:
+                    self.error(404, "not found")
+            except (BrokenPipeError, ConnectionResetError):
+                # the reader went away, nobody is left to answer
+                pass
+            except IndexError as e:
+                self.error(404, str(e))
+            except PermissionError as e:
+                self.error(403, str(e))
+            except (httpx.HTTPError, PageIntegrityError) as e:
+                self.error(502, repr(e))
+            except Exception as e:
+                # `book_contentsInfo` raises the error message of the site API as a plain exception
+                self.error(502, str(e) or repr(e))
+
+    return ThreadingHTTPServer((host, port), Handler)
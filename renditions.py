@@ -0,0 +1,250 @@
+import asyncio, concurrent.futures, copy, io, os, pathlib, shutil, threading, zipfile
+from typing import Literal
+from PIL import Image
+from client import ComiciClient
+from store import PageStore
+from structs import Rendition
+from tracing import span
+from utils import getLegalPath, encodeImage
+import integrity, metrics
+
+def render(image: Image.Image, rendition: Rendition) -> bytes:
+    """Encode a descrambled page for `rendition`, scaling down a copy when it has a smaller `max_size`"""
+    size = ComiciClient.fit_size(image.size, rendition.max_size)
+    if size == image.size:
+        with span("encode"):
+            return encodeImage(image, rendition.ls_webp, rendition.compression)
+    resized = image.resize(size, Image.Resampling.LANCZOS)
+    with span("encode"):
+        data = encodeImage(resized, rendition.ls_webp, rendition.compression)
+    resized.close()
+    return data
+
+def decode_size(renditions: list[Rendition]) -> tuple[int, int] | None:
+    """Pages are decoded once, at reduced scale only when every rendition has the same bound"""
+    sizes = {rendition.max_size for rendition in renditions}
+    return sizes.pop() if len(sizes) == 1 else None
+
+FsyncPolicy = Literal["page", "episode", "never"]
+
+def fsync_path(path: pathlib.Path):
+    """fsync a file or a directory, directories cannot be opened on Windows and are skipped"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path: pathlib.Path, data: bytes, fsync: bool = False):
+    """Write to a hidden temp file next to `path` and rename it, a crash never leaves a partial page"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class WriterPool:
+    """
+    Threads writing pages off the event loop, shared by all episodes of the process
+
+    At most `max_pending` writes are queued, `submit()` waits for a free slot so
+    a slow disk slows down the downloads instead of piling up encoded pages.
+    """
+    def __init__(self, workers: int = 4, max_pending: int = 64, fsync: FsyncPolicy = "never"):
+        self.configure(workers, max_pending, fsync)
+
+    def configure(self, workers: int, max_pending: int, fsync: FsyncPolicy):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def submit(self, func, *args) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="writer")
+        if self._loop is not loop:
+            self._loop, self._slots = loop, asyncio.Semaphore(self.max_pending)
+        slots = self._slots
+        await slots.acquire()
+        metrics.WRITE_QUEUE_DEPTH.inc()
+        future = loop.run_in_executor(self._executor, func, *args)
+        future.add_done_callback(lambda _: (slots.release(), metrics.WRITE_QUEUE_DEPTH.dec()))
+        return future
+
+pool = WriterPool()
+
+class RenditionWriter:
+    """
+    Pages of one episode in one `Rendition`, a page directory or a CBZ file
+
+    Pages are written through `pool`, to a temp file renamed into place for
+    directories, and to a hidden temp CBZ renamed when the episode is closed.
+    The temp CBZ is only created once a page has to be added, an episode with
+    nothing to write leaves its CBZ and manifest untouched. A temp CBZ left by
+    an earlier run is resumed when it is readable, deleted otherwise. Keeps the
+    `.pages.json` manifest of the output up to date, pages left in the
+    directory by an interrupted CBZ download are moved into the CBZ.
+    """
+    def __init__(self, rendition: Rendition, title: str, episode_name: str, overwrite: bool, digits: int, manifest: dict):
+        self.rendition = rendition
+        self.overwrite = overwrite
+        self.digits = digits
+        self.fsync = pool.fsync
+        self.encoding = PageStore.encoding_key(rendition.ls_webp, rendition.compression, rendition.max_size)
+        self.dir_path = pathlib.Path(rendition.save_dir) / getLegalPath(title) / getLegalPath(episode_name)
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+
+        self.is_cbz = rendition.kind == "cbz"
+        self.cbz_file: zipfile.ZipFile | None = None
+        self.append = False
+        self.names: set[str] = set()
+        self.path = self.dir_path
+        if self.is_cbz:
+            self.path = self.dir_path.parent / f"{getLegalPath(episode_name)}.cbz"
+            self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+            if self.tmp_path.exists() and (overwrite or not zipfile.is_zipfile(self.tmp_path)):
+                # left by a run that crashed before the CBZ was closed
+                self.tmp_path.unlink()
+            existing = self.tmp_path if self.tmp_path.exists() else self.path if self.path.exists() and not overwrite else None
+            if existing and zipfile.is_zipfile(existing):
+                with zipfile.ZipFile(existing) as cbz_file:
+                    self.names = set(cbz_file.namelist())
+                self.append = True
+
+        self.manifest = integrity.load_manifest(self.path)
+        self.saved_manifest = copy.deepcopy(self.manifest)
+        self.manifest.update(manifest, encoding=self.encoding)
+        self.futures: list[asyncio.Future] = list()
+        self.written: list[pathlib.Path] = list()
+        self._lock = threading.Lock()
+
+    def filename(self, sort: int) -> str:
+        return "{}.{}".format(str(sort + 1).rjust(self.digits, "0"), "webp" if self.rendition.ls_webp else "png")
+
+    def needs(self, sort: int) -> bool:
+        filename = self.filename(sort)
+        save_full_path = self.dir_path / filename
+        if self.is_cbz:
+            if filename in self.names:
+                return False
+            if save_full_path.exists():
+                with self._lock:
+                    self._open_cbz().write(save_full_path, filename)
+                self.names.add(filename)
+                save_full_path.unlink(missing_ok=True)
+                return False
+            return True
+        return self.overwrite or not save_full_path.exists()
+
+    async def put(self, sort: int, output: bytes | pathlib.Path, raw_digest: str | None = None):
+        """Queue encoded page bytes, or an object of the page store"""
+        self.names.add(self.filename(sort))
+        self.futures.append(await pool.submit(self._put, sort, output, raw_digest))
+
+    async def put_thumbnail(self, sort: int, thumbnail: Image.Image):
+        self.futures.append(await pool.submit(self._put_thumbnail, sort, thumbnail))
+
+    def _open_cbz(self) -> zipfile.ZipFile:
+        """The temp CBZ, copied from the existing CBZ on the first page added, `_lock` held"""
+        if self.cbz_file is None:
+            if self.append and not self.tmp_path.exists():
+                shutil.copyfile(self.path, self.tmp_path)
+            self.cbz_file = zipfile.ZipFile(str(self.tmp_path), "a" if self.append else "w")
+        return self.cbz_file
+
+    def _write_member(self, name: str, data: bytes | None = None, source: pathlib.Path | None = None):
+        if self.is_cbz:
+            with span("cbz.write"), self._lock:
+                cbz_file = self._open_cbz()
+                if source:
+                    cbz_file.write(source, name)
+                else:
+                    cbz_file.writestr(name, data)
+                if self.fsync == "page":
+                    cbz_file.fp.flush()
+                    os.fsync(cbz_file.fp.fileno())
+            return
+        self._write_file(self.dir_path / name, data, source)
+
+    def _write_file(self, path: pathlib.Path, data: bytes | None = None, source: pathlib.Path | None = None):
+        if source:
+            with span("store.link"):
+                PageStore.link(source, path)
+            if self.fsync == "page":
+                fsync_path(path)
+        else:
+            with span("write"):
+                atomic_write(path, data, self.fsync == "page")
+        if self.fsync == "page":
+            fsync_path(path.parent)
+        elif self.fsync == "episode":
+            with self._lock:
+                self.written.append(path)
+
+    def _put(self, sort: int, output: bytes | pathlib.Path, raw_digest: str | None):
+        filename = self.filename(sort)
+        if isinstance(output, pathlib.Path):
+            self._write_member(filename, source=output)
+            entry = integrity.page_entry(sort, output.stem, output.stat().st_size, raw_digest)
+        else:
+            self._write_member(filename, output)
+            entry = integrity.page_entry(sort, integrity.digest(output), len(output), raw_digest)
+        self.manifest["pages"][filename] = entry
+
+    def _put_thumbnail(self, sort: int, thumbnail: Image.Image):
+        buffer = io.BytesIO()
+        thumbnail.convert("RGB").save(buffer, "JPEG", quality=85)
+        thumbnail.close()
+        # never inside the CBZ, readers would show them as pages
+        directory = self.path.with_name(f"{self.path.stem}.thumbnails") if self.is_cbz else self.dir_path / "thumbnails"
+        directory.mkdir(exist_ok=True)
+        self._write_file(directory / f"{str(sort + 1).rjust(self.digits, '0')}.jpg", buffer.getvalue())
+
+    def _finish(self) -> pathlib.Path:
+        if self.is_cbz and self.cbz_file is None and self.tmp_path.exists():
+            # temp CBZ of an earlier run, it has pages the CBZ lacks
+            self._open_cbz()
+        changed = self.manifest != self.saved_manifest
+        if changed:
+            integrity.save_manifest(self.path, self.manifest)
+        if self.cbz_file:
+            self.cbz_file.close()
+            if self.fsync != "never":
+                fsync_path(self.tmp_path)
+            os.replace(self.tmp_path, self.path)
+        if self.is_cbz:
+            try:
+                self.dir_path.rmdir()
+            except OSError:
+                pass
+        if self.fsync == "episode":
+            for path in self.written:
+                fsync_path(path)
+            for directory in {path.parent for path in self.written}:
+                fsync_path(directory)
+        if self.fsync != "never" and (changed or self.cbz_file):
+            if changed:
+                fsync_path(integrity.manifest_path(self.path))
+            fsync_path(self.path.parent)
+        return self.path
+
+    async def close(self) -> pathlib.Path:
+        """
+        Wait for the queued writes, then save the manifest and move the CBZ into place
+
+        Pages written before a write failed are kept, the error is raised afterwards.
+        """
+        results = await asyncio.gather(*self.futures, return_exceptions=True)
+        error = next((result for result in results if isinstance(result, BaseException)), None)
+        path = await (await pool.submit(self._finish))
+        if error:
+            raise error
+        return path
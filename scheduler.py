@@ -0,0 +1,173 @@
+"""
+Order of the episodes of `download-series`
+
+The paging list order is kept by default. The other policies rank episodes by
+publication date, by the end of their access window (`閲覧期限`), by page count,
+or take one episode of every series in turn. The window and page count come
+from `book/episodeInfo`, requested once per series, and the window also from the
+date of a `閲覧期限` symbol when the episode is missing there.
+
+Episodes are pushed while the scheduler runs, series whose paging list arrives
+later join the queue. An episode whose window closes within `preempt_within`
+seconds takes the slot of the lowest ranked running episode when all are busy;
+that episode is cancelled, keeps the pages written so far and is queued again.
+"""
+import asyncio, datetime, heapq, itertools, math, re, time
+from typing import Awaitable, Callable, Literal
+from urllib.parse import urlsplit
+from client import ComiciClient
+from structs import EpisodeJob, MangaEpisodeItem
+
+Policy = Literal["paging", "newest", "expiring", "smallest", "round-robin"]
+
+DATE_PATTERN = re.compile(r"(\d{4})[/\-.年](\d{1,2})[/\-.月](\d{1,2})日?(?:\s*(\d{1,2}):(\d{2}))?")
+
+def parse_date(text: str | None) -> datetime.datetime | None:
+    """First date of `2024/01/31`, `2024-01-31 23:59:00` or `2024年1月31日` in `text`"""
+    match = DATE_PATTERN.search(text or "")
+    if not match:
+        return None
+    year, month, day, hour, minute = match.groups()
+    try:
+        return datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+    except ValueError:
+        return None
+
+def episode_jobs(
+        comici_client: ComiciClient,
+        series_index: int,
+        paging_list: list[MangaEpisodeItem],
+        accessible: Callable[[MangaEpisodeItem], bool],
+        with_info: bool = False,
+    ) -> list[EpisodeJob]:
+    """Jobs of the accessible episodes of one series, `with_info` adds access windows and page counts, blocking"""
+    jobs = list()
+    for episode in paging_list:
+        if not accessible(episode):
+            continue
+        symbol = episode.symbols[0] if episode.symbols else ""
+        jobs.append(EpisodeJob(
+            series_index,
+            len(jobs),
+            urlsplit(episode.href).path.rstrip("/").split("/")[-1],
+            episode.title,
+            published=parse_date(episode.update_date),
+            end_date=parse_date(symbol) if symbol.startswith("閲覧期限") else None,
+        ))
+    if not with_info or not jobs:
+        return jobs
+
+    try:
+        comici_viewer_id = comici_client.contents_manager(jobs[0].episode_id).comici_viewer_id
+        infos = {info.name.strip(): info for info in comici_client.book_episodeInfo(comici_viewer_id)}
+    except Exception:
+        # Comici+ sites and restricted first episodes have no episode info, the paging list has to do
+        return jobs
+    for job in jobs:
+        info = infos.get(job.title.strip())
+        if not info:
+            continue
+        if info.end_date:
+            job.end_date = info.end_date
+        if not job.published and info.publish_date:
+            job.published = info.publish_date
+        if str(info.page_count).isdigit():
+            job.pages = int(info.page_count)
+    return jobs
+
+def priority(job: EpisodeJob, policy: Policy) -> tuple:
+    """Lower runs first, unknown dates and sizes last"""
+    if policy == "newest":
+        return (-job.published.timestamp() if job.published else math.inf, job.series_index, job.order)
+    if policy == "expiring":
+        return (job.end_date.timestamp() if job.end_date else math.inf, job.series_index, job.order)
+    if policy == "smallest":
+        return (job.pages if job.pages else math.inf, job.series_index, job.order)
+    if policy == "round-robin":
+        return (job.order, job.series_index)
+    return (job.series_index, job.order)
+
+class EpisodeScheduler:
+    def __init__(
+            self,
+            policy: Policy = "paging",
+            concurrency: int = 1,
+            preempt_within: float = 0,
+            on_preempt: Callable[[EpisodeJob, EpisodeJob], None] | None = None,
+        ):
+        self.policy = policy
+        self.concurrency = concurrency
+        self.preempt_within = preempt_within
+        self.on_preempt = on_preempt
+        self.queue: list[tuple[tuple, int, EpisodeJob]] = list()
+        self.running: dict[asyncio.Task, EpisodeJob] = dict()
+        self.cancelling: set[asyncio.Task] = set()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def urgent(self, job: EpisodeJob) -> bool:
+        return bool(self.preempt_within and job.end_date and job.end_date.timestamp() - time.time() <= self.preempt_within)
+
+    def key(self, job: EpisodeJob) -> tuple:
+        """Urgent episodes run first whatever the policy"""
+        return (not self.urgent(job), *priority(job, self.policy))
+
+    def push(self, job: EpisodeJob):
+        heapq.heappush(self.queue, (self.key(job), next(self._counter), job))
+        if self.urgent(job) and len(self.running) - len(self.cancelling) >= self.concurrency:
+            self.preempt(job)
+        self._wakeup.set()
+
+    def preempt(self, job: EpisodeJob):
+        """Cancel the lowest ranked running episode that is not urgent itself"""
+        candidates = [
+            (self.key(running_job), task) for task, running_job in self.running.items()
+            if task not in self.cancelling and not self.urgent(running_job)
+        ]
+        if not candidates:
+            return
+        _, task = max(candidates, key=lambda candidate: candidate[0])
+        self.cancelling.add(task)
+        task.cancel()
+        if self.on_preempt:
+            self.on_preempt(self.running[task], job)
+
+    async def run(
+            self,
+            download: Callable[[EpisodeJob], Awaitable[bool]],
+            producers: Awaitable | None = None,
+        ) -> list[tuple[EpisodeJob, bool | BaseException]]:
+        """
+        Run queued episodes until the queue is empty and `producers` finished pushing
+
+        Returns `(job, result)` pairs, the exception of an episode that failed is its result.
+        """
+        results = list()
+        producers = asyncio.ensure_future(producers) if producers is not None else None
+        while True:
+            while self.queue and len(self.running) - len(self.cancelling) < self.concurrency:
+                job = heapq.heappop(self.queue)[2]
+                self.running[asyncio.create_task(download(job))] = job
+            if not self.queue and not self.running and (producers is None or producers.done()):
+                break
+
+            self._wakeup.clear()
+            waiter = asyncio.create_task(self._wakeup.wait())
+            waiting = {waiter, *self.running}
+            if producers is not None and not producers.done():
+                waiting.add(producers)
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+
+            for task in done & self.running.keys():
+                job = self.running.pop(task)
+                self.cancelling.discard(task)
+                if task.cancelled():
+                    heapq.heappush(self.queue, (self.key(job), next(self._counter), job))
+                elif task.exception():
+                    results.append((job, task.exception()))
+                else:
+                    results.append((job, bool(task.result())))
+        if producers is not None:
+            producers.result()
+        return results
@@ -0,0 +1,156 @@
+import itertools, sqlite3, json, pathlib, re, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+JOB_OPTIONS = {
+    "save_dir", "cbz", "overwrite", "wait_interval", "ls_webp", "compression",
+    "threads", "store", "page_from", "page_to",
+}
+
+class ServerJobs:
+    """
+    Persistent job list of `serve`
+
+    Jobs still queued or running when the server stops are queued again on the
+    next start, downloads skip pages already on disk so re-running is cheap.
+    """
+    def __init__(self, path: str | pathlib.Path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, action TEXT NOT NULL, target TEXT NOT NULL, "
+                "kind TEXT NOT NULL, options TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'queued', "
+                "error TEXT, episodes INTEGER, episodes_done INTEGER NOT NULL DEFAULT 0, "
+                "created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._db.execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+        self.progress: dict[int, "JobProgress"] = dict()
+
+    def add(self, action: str, target: str, kind: str, options: dict) -> int:
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (action, target, kind, options, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (action, target, kind, json.dumps(options), now, now)
+            )
+        return cursor.lastrowid
+
+    def update(self, job_id: int, **fields):
+        fields["updated"] = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+
+    def queued(self) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY id").fetchall()
+        return [self._row(row) for row in rows]
+
+    def get(self, job_id: int) -> dict | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, limit: int = 100) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def _row(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        progress = self.progress.get(job["id"])
+        if progress:
+            job["pages"], job["pages_done"] = progress.total, progress.completed
+        return job
+
+    def close(self):
+        self._db.close()
+
+class JobProgress:
+    """Stands in for `rich.progress.Progress` in `download_episode_async`, counting pages of one job"""
+    def __init__(self):
+        self.tasks: dict[int, list[float]] = dict()
+        self._ids = itertools.count()
+
+    def add_task(self, description: str, total: float = 0) -> int:
+        task_id = next(self._ids)
+        self.tasks[task_id] = [total, 0]
+        return task_id
+
+    def advance(self, task_id: int, advance: float = 1):
+        self.tasks[task_id][1] += advance
+
+    def remove_task(self, task_id: int):
+        """Episode cancelled or failed, its pages no longer count"""
+        self.tasks.pop(task_id, None)
+
+    @property
+    def total(self) -> int:
+        return int(sum(task[0] for task in self.tasks.values()))
+
+    @property
+    def completed(self) -> int:
+        return int(sum(task[1] for task in self.tasks.values()))
+
+JOB_PATH = re.compile(r"^/jobs/(\d+)/?$")
+
+def serve_jobs(jobs: ServerJobs, submit, cancel, info, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Local JSON API of `serve`
+
+    `POST /jobs`, `GET /jobs`, `GET /jobs/<id>`, `DELETE /jobs/<id>` and `GET /health`.
+    `submit(body) -> id`, `cancel(id) -> bool` and `info() -> dict` are called from the HTTP threads.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status: int, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path.rstrip("/") == "/health":
+                self.reply(200, info())
+            elif path.rstrip("/") == "/jobs":
+                self.reply(200, jobs.list())
+            elif match := JOB_PATH.match(path):
+                job = jobs.get(int(match.group(1)))
+                self.reply(200 if job else 404, job if job else {"error": "not found"})
+            else:
+                self.reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.split("?")[0].rstrip("/") != "/jobs":
+                self.reply(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                job_id = submit(json.loads(self.rfile.read(length) or b"{}"))
+            except (ValueError, KeyError, TypeError) as e:
+                self.reply(400, {"error": str(e)})
+                return
+            self.reply(201, jobs.get(job_id))
+
+        def do_DELETE(self):
+            match = JOB_PATH.match(self.path.split("?")[0])
+            if not match:
+                self.reply(404, {"error": "not found"})
+                return
+            job_id = int(match.group(1))
+            if not cancel(job_id):
+                self.reply(409, {"error": "job is not queued or running"})
+                return
+            self.reply(200, jobs.get(job_id))
+
+    return ThreadingHTTPServer((host, port), Handler)
@@ -0,0 +1,105 @@
+"""
+Probe of Comici sites for `sites --probe`, and the registry of the results
+
+Every host is requested concurrently, at most `concurrency` at a time: the top
+page for reachability, latency and the version (old sites have a `contentLink`
+span, Comici+ sites do not), then the endpoints listed in `ENDPOINTS`. Redirects
+are not followed, the version is only recorded from a 2xx top page. Results
+are kept in `<cache_dir>/sites.json`; `ComiciClient` takes the version of a
+host from there instead of requesting its top page, and `download-batch` skips
+hosts that were unreachable, as long as the probe is younger than `MAX_AGE`.
+"""
+import asyncio, json, os, pathlib, time
+from dataclasses import asdict
+from urllib.parse import urljoin
+import httpx
+from bs4 import BeautifulSoup as bs
+from structs import SiteProbe
+import archive
+
+REGISTRY_NAME = "sites.json"
+MAX_AGE = 7 * 24 * 3600
+# name: (path, params, answers with JSON)
+ENDPOINTS = {
+    "search": ("/search", {"keyword": "a", "page": 0, "size": 1}, False),
+    "api_search": ("/api/search", {"q": "a", "page": 1, "size": 1}, True),
+    "series_list": ("/series/list", {}, False),
+}
+
+def registry_path(cache_dir: str | pathlib.Path | None) -> pathlib.Path | None:
+    return pathlib.Path(cache_dir) / REGISTRY_NAME if cache_dir else None
+
+def load_registry(cache_dir: str | pathlib.Path | None) -> dict[str, SiteProbe]:
+    path = registry_path(cache_dir)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {host: SiteProbe(**probe) for host, probe in json.load(f)["hosts"].items()}
+    except (TypeError, OSError, ValueError, KeyError):
+        return dict()
+
+def save_registry(cache_dir: str | pathlib.Path, probes: list[SiteProbe]):
+    """Merge `probes` into the registry, older results of other hosts are kept"""
+    path = registry_path(cache_dir)
+    registry = load_registry(cache_dir)
+    registry.update({probe.host: probe for probe in probes})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"hosts": {host: asdict(probe) for host, probe in sorted(registry.items())}}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+def lookup(cache_dir: str | pathlib.Path | None, host: str) -> SiteProbe | None:
+    """The probe of `host` if it is recent enough to be trusted"""
+    probe = load_registry(cache_dir).get(host)
+    if probe is None or time.time() - probe.probed_at > MAX_AGE:
+        return None
+    return probe
+
+async def probe_host(http_client: httpx.AsyncClient, host: str) -> SiteProbe:
+    started = time.perf_counter()
+    try:
+        response = await http_client.get(host)
+    except httpx.HTTPError as e:
+        return SiteProbe(host, False, None, None, None, dict(), time.time(), repr(e))
+    latency = round(time.perf_counter() - started, 3)
+    if response.status_code >= 400:
+        return SiteProbe(host, False, response.status_code, latency, None, dict(), time.time(), f"HTTP {response.status_code}")
+    if not response.is_success:
+        # a redirect tells nothing of the site behind it, clients still check the version themselves
+        error = f"Redirected to {response.headers.get('Location', '')}" if response.is_redirect else f"HTTP {response.status_code}"
+        return SiteProbe(host, True, response.status_code, latency, None, dict(), time.time(), error)
+
+    new_version = bs(response.text, "html.parser").find("span", {"id": "contentLink"}) is None
+    endpoints = dict()
+    for name, (path, params, is_json) in ENDPOINTS.items():
+        try:
+            endpoint_response = await http_client.get(urljoin(host, path), params=params)
+            endpoints[name] = endpoint_response.status_code == 200
+            if endpoints[name] and is_json:
+                endpoint_response.json()
+        except (httpx.HTTPError, ValueError):
+            endpoints[name] = False
+    return SiteProbe(host, True, response.status_code, latency, new_version, endpoints, time.time())
+
+async def probe_sites(
+        hosts: list[str],
+        concurrency: int = 8,
+        timeout: float = 10.0,
+        user_agent: str | None = None,
+        proxy: str | None = None,
+    ) -> list[SiteProbe]:
+    """`SiteProbe` of every host in the order of `hosts`, `timeout` applies to every request"""
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(
+        headers={"User-Agent": user_agent} if user_agent else None,
+        timeout=timeout,
+        transport=archive.wrap(httpx.AsyncHTTPTransport(retries=1, proxy=proxy), "probe"),
+    ) as http_client:
+        async def probe(host: str) -> SiteProbe:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(probe_host(http_client, host), timeout * (len(ENDPOINTS) + 1))
+                except asyncio.TimeoutError:
+                    return SiteProbe(host, False, None, None, None, dict(), time.time(), "Timed out")
+
+        return await asyncio.gather(*[probe(host) for host in hosts])
@@ -0,0 +1,114 @@
+import sqlite3, hashlib, os, shutil, pathlib, threading
+from urllib.parse import urlsplit
+
+class PageStore:
+    """
+    Content-addressed store of encoded pages
+
+    Objects are keyed by the sha256 of the encoded output, and every object is
+    linked to the sha256 of the raw CDN bytes it was produced from, so that the
+    same page served by different Comici hosts is only fetched and encoded once.
+    """
+    INDEX_NAME = "index.sqlite3"
+
+    def __init__(self, root: str | pathlib.Path):
+        self.root = pathlib.Path(root)
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / self.INDEX_NAME, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "url_key TEXT PRIMARY KEY, raw_digest TEXT NOT NULL, width INTEGER, height INTEGER)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS renditions ("
+                "raw_digest TEXT NOT NULL, encoding TEXT NOT NULL, digest TEXT NOT NULL, "
+                "PRIMARY KEY (raw_digest, encoding))"
+            )
+
+    @staticmethod
+    def url_key(image_url: str) -> str:
+        """Signed query strings change on every request, only the path identifies a page"""
+        return urlsplit(image_url).path
+
+    @staticmethod
+    def encoding_key(ls_webp: bool, compression: int, max_size: tuple[int, int] | None = None) -> str:
+        """`png-1`, `webp-6-1080x0` for pages scaled down to fit a maximum size"""
+        key = f"{'webp' if ls_webp else 'png'}-{compression}"
+        return f"{key}-{max_size[0]}x{max_size[1]}" if max_size else key
+
+    @staticmethod
+    def parse_encoding(encoding: str) -> tuple[bool, int, tuple[int, int] | None]:
+        """`(ls_webp, compression, max_size)` of an `encoding_key()`"""
+        parts = encoding.split("-")
+        max_size = tuple(int(side) for side in parts[2].split("x")) if len(parts) > 2 else None
+        return parts[0] == "webp", int(parts[1]), max_size
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def object_path(self, digest: str, encoding: str) -> pathlib.Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.{encoding.split('-')[0]}"
+
+    def lookup(self, image_url: str, width: int, height: int, encoding: str) -> pathlib.Path | None:
+        """Fast pre-check before fetching, matches by imageUrl path and page size"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT renditions.digest FROM urls JOIN renditions USING (raw_digest) "
+                "WHERE urls.url_key = ? AND urls.width = ? AND urls.height = ? AND renditions.encoding = ?",
+                (self.url_key(image_url), width, height, encoding)
+            ).fetchone()
+        return self._existing(row[0], encoding) if row else None
+
+    def find(self, raw_digest: str, encoding: str) -> pathlib.Path | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM renditions WHERE raw_digest = ? AND encoding = ?",
+                (raw_digest, encoding)
+            ).fetchone()
+        return self._existing(row[0], encoding) if row else None
+
+    def _existing(self, digest: str, encoding: str) -> pathlib.Path | None:
+        path = self.object_path(digest, encoding)
+        return path if path.exists() else None
+
+    def remember(self, image_url: str, width: int, height: int, raw_digest: str):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)",
+                (self.url_key(image_url), raw_digest, width, height)
+            )
+
+    def put(self, raw_digest: str, encoding: str, data: bytes) -> pathlib.Path:
+        digest = self.digest(data)
+        path = self.object_path(digest, encoding)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO renditions VALUES (?, ?, ?)",
+                (raw_digest, encoding, digest)
+            )
+        return path
+
+    @staticmethod
+    def link(object_path: pathlib.Path, dest: str | pathlib.Path):
+        """Hardlink an object into a save_dir tree, copy when hardlinks are unavailable, `dest` is replaced atomically"""
+        dest = pathlib.Path(dest)
+        tmp_path = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:
+            shutil.copyfile(object_path, tmp_path)
+        os.replace(tmp_path, dest)
+
+    def close(self):
+        self._db.close()
@@ -1,12 +1,12 @@
 from dataclasses import dataclass, asdict
-import json, datetime
+import json, datetime, asyncio, functools
 
-@dataclass
+@dataclass(slots=True)
 class Author:
     name: str
     href: str
 
-@dataclass
+@dataclass(slots=True)
 class MangaStoreItem:
     href: str
     title: str
@@ -17,20 +17,20 @@ class MangaStoreItem:
             if isinstance(self.author[i], str):
                 self.author[i] = Author(self.author[i], "")
 
-@dataclass
+@dataclass(slots=True)
 class MangaEpisodeItem:
     href: str
     title: str
     update_date: str
     symbols: list[str]
 
-@dataclass
+@dataclass(slots=True)
 class BookshelfItem:
     href: str
     title: str
     last_update: str
 
-@dataclass
+@dataclass(slots=True)
 class Info:
    _id: str
    title: str
@@ -40,23 +40,36 @@ class Info:
    end_date: str
    authors: str | None
 
-@dataclass
+@functools.lru_cache(maxsize=4096)
+def parse_isoformat(text: str) -> datetime.datetime | None:
+    """Catalogues repeat the same few dates, parsed once and shared"""
+    return datetime.datetime.fromisoformat(text) if text else None
+
+@functools.lru_cache(maxsize=4096)
+def parse_scramble(text: str) -> tuple[int, ...]:
+    return tuple(json.loads(text))
+
+@dataclass(slots=True)
 class EpisodeInfo:
+    """`publish_date` and `end_date` are accepted as ISO text of the API"""
     _id: str # == comici_viewer_id
     name: str
     description: str
     thumb_image_url: str
     page_count: str
     episode_number: str
-    publish_date: datetime.datetime
+    publish_date: datetime.datetime | None
     end_date: datetime.datetime | None
 
     def __post_init__(self):
-        self.publish_date = datetime.datetime.fromisoformat(self.publish_date) if self.publish_date else None
-        self.end_date = datetime.datetime.fromisoformat(self.end_date) if self.end_date else None
+        if isinstance(self.publish_date, str):
+            self.publish_date = parse_isoformat(self.publish_date)
+        if isinstance(self.end_date, str):
+            self.end_date = parse_isoformat(self.end_date)
 
-@dataclass
+@dataclass(slots=True)
 class ContentsInfo:
+    """`scramble` is accepted as JSON text and `expiresOn` as epoch ms, as the API sends them"""
     imageUrl: str
     scramble: list[int]
     sort: int
@@ -65,19 +78,74 @@ class ContentsInfo:
     expiresOn: datetime.datetime
 
     def __post_init__(self):
-        self.scramble = json.loads(self.scramble)
-        self.expiresOn = datetime.datetime.fromtimestamp(self.expiresOn / 1000)
+        if isinstance(self.scramble, str):
+            self.scramble = list(parse_scramble(self.scramble))
+        if not isinstance(self.expiresOn, datetime.datetime):
+            self.expiresOn = datetime.datetime.fromtimestamp(self.expiresOn / 1000)
 
-@dataclass
+@dataclass(slots=True)
 class Tag:
     _id: str
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class SeriesSummary(MangaStoreItem):
     numEpisodes: int
 
-@dataclass
+@dataclass(slots=True)
 class NewMangaEpisodeItem(MangaEpisodeItem):
     hasAccess: bool
-    accessType: str
\ No newline at end of file
+    accessType: str
+
+@dataclass(frozen=True, slots=True)
+class RequestContext:
+    host: str
+    episode_id: str
+    headers: dict[str, str]
+    semaphore: asyncio.Semaphore | None = None
+
+@dataclass(slots=True)
+class Job:
+    _id: int
+    host: str
+    series_id: str
+    episode_id: str
+    page_from: int
+    page_to: int
+    attempts: int
+
+@dataclass(slots=True)
+class EpisodePlan:
+    episode_id: str
+    title: str
+    pages: int
+    present: int
+
+@dataclass(frozen=True, slots=True)
+class Rendition:
+    kind: str
+    ls_webp: bool = False
+    compression: int = 1
+    max_size: tuple[int, int] | None = None
+    save_dir: str = ""
+
+@dataclass(slots=True)
+class SiteProbe:
+    host: str
+    reachable: bool
+    status: int | None
+    latency: float | None
+    new_version: bool | None
+    endpoints: dict[str, bool]
+    probed_at: float
+    error: str = ""
+
+@dataclass(eq=False, slots=True)
+class EpisodeJob:
+    series_index: int
+    order: int
+    episode_id: str
+    title: str
+    published: datetime.datetime | None = None
+    end_date: datetime.datetime | None = None
+    pages: int | None = None
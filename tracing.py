@@ -0,0 +1,141 @@
+import asyncio, contextlib, functools, inspect, json, os, threading, time
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict | None):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+class Tracer:
+    """
+    Collects timed spans of download stages
+
+    Disabled by default, `span()` then returns a shared no-op context manager.
+    Spans opened by different asyncio tasks are kept on separate tracks so that
+    overlapping pages do not mix in the Chrome trace viewer.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.recording = False
+        self.listeners: list = list()
+        self.events: list[tuple[str, int, int, tuple[str, int], dict | None]] = list()
+        self.origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self.recording = True
+        self.origin = time.perf_counter_ns()
+
+    def add_listener(self, listener):
+        """Call `listener(name, seconds)` for every finished span, without keeping the events"""
+        self.listeners.append(listener)
+        self.enabled = True
+
+    def span(self, name: str, **args) -> contextlib.AbstractContextManager:
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args or None)
+
+    @staticmethod
+    def _track() -> tuple[str, int]:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task:
+            return "task", id(task)
+        return "thread", threading.get_ident()
+
+    def record(self, name: str, start: int, duration: int, args: dict | None = None):
+        if self.recording:
+            with self._lock:
+                self.events.append((name, start, duration, self._track(), args))
+        for listener in self.listeners:
+            listener(name, duration / 1e9)
+
+    def traced(self, name: str | None = None):
+        """Decorator version of `span()`, works for both functions and coroutines"""
+        def decorator(func):
+            span_name = name if name else func.__qualname__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def chrome_trace(self) -> dict:
+        """Trace Event Format, open with chrome://tracing or https://ui.perfetto.dev"""
+        pid = os.getpid()
+        tids: dict[tuple[str, int], int] = dict()
+        trace_events = list()
+        with self._lock:
+            events = list(self.events)
+        for name, start, duration, track, args in events:
+            if track not in tids:
+                tids[track] = len(tids) + 1
+                trace_events.append({
+                    "name": "thread_name", "ph": "M", "pid": pid, "tid": tids[track],
+                    "args": {"name": f"{track[0]} {tids[track]}"},
+                })
+            event = {
+                "name": name,
+                "cat": name.split(".")[0],
+                "ph": "X",
+                "ts": (start - self.origin) / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": tids[track],
+            }
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self) -> list[tuple[str, int, float, float, float]]:
+        """(stage, count, p50 ms, p95 ms, total ms) sorted by total time"""
+        durations: dict[str, list[int]] = dict()
+        with self._lock:
+            for name, _, duration, _, _ in self.events:
+                durations.setdefault(name, list()).append(duration)
+
+        def percentile(values: list[int], q: float) -> float:
+            return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] / 1e6
+
+        result = list()
+        for name, values in durations.items():
+            values.sort()
+            result.append((name, len(values), percentile(values, 0.5), percentile(values, 0.95), sum(values) / 1e6))
+        return sorted(result, key=lambda r: r[4], reverse=True)
+
+_NULL_SPAN = contextlib.nullcontext()
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
@@ -1,4 +1,10 @@
-import re
+import re, io
+from urllib.parse import urlsplit
+from parallel_png import encode_png
+from structs import Rendition
+
+# threads deflating each PNG, set by `--png-threads`, 1: Pillow's single-threaded encoder
+PNG_THREADS = 1
 
 def getLegalPath(rawPath: str) -> str:
 
@@ -14,4 +20,67 @@ def getLegalPath(rawPath: str) -> str:
     for m in re.finditer(r'[\\/:*?"<>|\r\n]', rawPath):
         replacedPath = replacedPath[:m.start()] + getFullwidth(m.group()) + replacedPath[m.end():]
     
-    return replacedPath
\ No newline at end of file
+    return replacedPath
+
+def saveImage(image, fp, ls_webp: bool = False, compression: int = 1):
+    if ls_webp:
+        image.save(fp, "WEBP", lossless=True, method=compression if compression <= 6 else 6)
+    elif PNG_THREADS > 1:
+        fp.write(encode_png(image, compression, PNG_THREADS))
+    else:
+        image.save(fp, "PNG", compress_level=compression)
+
+def encodeImage(image, ls_webp: bool = False, compression: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    saveImage(image, buffer, ls_webp, compression)
+    return buffer.getvalue()
+
+def normalizeHost(host: str) -> str:
+    """`https://<hostname>` by default, an explicit scheme and port are kept, e.g. for local stand-in servers"""
+    parts = urlsplit(host if "//" in host else "https://" + host)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def parseTarget(target: str, host: str, kind: str = "series") -> tuple[str, str, str]:
+    """
+    `(host, "series" | "episode", id)` of a bare ID or an URL of any Comici site
+
+    Bare 13 char IDs are `kind`, 32 char Comici Viewer IDs are always episodes
+    """
+    target = target.strip()
+    if "/" in target:
+        parts = urlsplit(target if "//" in target else "https://" + target)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        if "episodes" in segments[:-1]:
+            kind = "episode"
+        elif "series" in segments[:-1]:
+            kind = "series"
+        host = normalizeHost(target)
+        target = segments[-1] if segments else ""
+    if len(target) == 32:
+        kind = "episode"
+    elif len(target) != 13:
+        raise ValueError(f"Invalid series / episode ID: '{target}'")
+    return host, kind, target
+
+def parseRendition(spec: str, save_dir: str = "") -> Rendition:
+    """
+    `Rendition` of `<dir|cbz>:<png|webp>[:<compression>][:<W>x<H>][@<save_dir>]`
+
+    e.g. `dir:png`, `cbz:webp:6:1080x0@/mnt/reader`, a 0 side of the size is unbounded
+    """
+    spec, _, target_dir = spec.strip().partition("@")
+    parts = spec.split(":")
+    if len(parts) < 2 or len(parts) > 4 or parts[0] not in ("dir", "cbz") or parts[1] not in ("png", "webp"):
+        raise ValueError(f"Invalid output '{spec}', expected <dir|cbz>:<png|webp>[:<compression>][:<W>x<H>]")
+    compression, max_size = 1, None
+    for part in parts[2:]:
+        if "x" in part:
+            width, _, height = part.partition("x")
+            if not (width.isdigit() and height.isdigit()):
+                raise ValueError(f"Invalid size '{part}' in output '{spec}'")
+            max_size = (int(width), int(height)) if int(width) or int(height) else None
+        elif part.isdigit() and int(part) <= (6 if parts[1] == "webp" else 9):
+            compression = int(part)
+        else:
+            raise ValueError(f"Invalid compression '{part}' in output '{spec}'")
+    return Rendition(parts[0], parts[1] == "webp", compression, max_size, target_dir or save_dir)